@@ -0,0 +1,334 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+""" Benchmarks for fourch's hot paths, run against a local mock API
+    (see ``server.py``), so the numbers don't depend on 4chan or the network.
+
+    It reports:
+
+    - parse: decoding thread json and building :class:`fourch.Thread`
+      objects from it, and rendering comments to text;
+    - update: the cost of :meth:`fourch.Thread.update` when nothing has
+      changed (304) and when a few replies have been posted (200);
+    - catalog: fetching the catalog (200, and 304 when it's unchanged), and
+      building every thread from it with :meth:`fourch.Board.all_threads`,
+      with and without hydrating them;
+    - sync: :meth:`fourch.Board.sync` over a board of cached threads, when
+      nothing has changed and when a few threads have new replies;
+    - memory: how much memory cached threads take, measured with
+      tracemalloc where it's available, next to :class:`fourch.ThreadCache`'s
+      own estimate;
+    - cache: storing threads in a large :class:`fourch.ThreadCache`,
+      unbounded and with ``max_entries``, which should cost the same
+      however many threads it holds;
+    - download: :class:`fourch.Downloader` throughput.
+
+    Run it from the top of the repository::
+
+        $ python bench/run.py
+        $ python bench/run.py --only parse update --json results.json
+
+    Saving results with ``--json`` and passing them back with ``--compare``
+    shows the change against an earlier run.
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import fourch  # noqa: E402
+import server  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+def timed(fn, repeat):
+    """ Run ``fn`` ``repeat`` times, returning the best time for one run. """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.time()
+        fn()
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return max(best, 1e-9)
+
+
+def bench_parse(args, api, board):
+    res = api.add_thread("bench", args.replies)
+    body = json.dumps(api.route("/bench/thread/{0}.json".format(res))[0])
+    body = body.encode("utf-8")
+    posts = args.replies + 1
+    results = {}
+
+    took = timed(lambda: fourch.loads(body), args.repeat)
+    results["decode MB/s"] = len(body) / took / 1e6
+
+    decoded = fourch.loads(body)
+    took = timed(lambda: fourch.Thread.from_json(board, decoded, res),
+                 args.repeat)
+    results["from_json posts/s"] = posts / took
+
+    took = timed(lambda: fourch.Thread.from_json(board, fourch.loads(body),
+                                                 res),
+                 args.repeat)
+    results["decode+from_json posts/s"] = posts / took
+
+    t = fourch.Thread.from_json(board, decoded, res)
+
+    def render():
+        for r in [t.op] + t.replies:
+            r._text = None
+            r.comment_text
+
+    took = timed(render, args.repeat)
+    results["comment_text posts/s"] = posts / took
+    return results
+
+
+def bench_update(args, api, board):
+    res = api.add_thread("bench", args.replies)
+    t = board.thread(res, update_cache=False)
+    results = {}
+
+    took = timed(t.update, args.repeat)
+    results["update 304 ms"] = took * 1000
+
+    def grow():
+        api.reply("bench", res, args.new)
+        start = time.time()
+        new = t.update()
+        took = time.time() - start
+        assert new == args.new, new
+        return took
+
+    took = min(grow() for _ in range(args.repeat))
+    results["update 200 (+{0}) ms".format(args.new)] = took * 1000
+
+    api.kill("bench", res)
+    results["update 404 ms"] = timed(t.update, 1) * 1000
+    return results
+
+
+def bench_catalog(args, api, board):
+    for _ in range(args.threads):
+        api.add_thread("catalog", args.replies)
+    results = {}
+
+    def cold():
+        b = fourch.Board("catalog", client=fourch.Client())
+        start = time.time()
+        b.catalog()
+        return time.time() - start
+
+    results["catalog 200 ms"] = min(cold() for _ in range(args.repeat)) * 1000
+
+    b = fourch.Board("catalog", client=fourch.Client())
+    b.catalog()
+    results["catalog 304 ms"] = timed(b.catalog, args.repeat) * 1000
+
+    def build(hydrate):
+        b = fourch.Board("catalog", client=fourch.Client())
+        start = time.time()
+        threads = b.all_threads(hydrate=hydrate)
+        took = time.time() - start
+        assert len(threads) == args.threads, len(threads)
+        if hydrate:
+            assert not any(t.omitted_posts for t in threads)
+        return took
+
+    results["all_threads threads/s"] = args.threads / min(
+        build(False) for _ in range(args.repeat))
+    results["all_threads hydrate threads/s"] = args.threads / min(
+        build(True) for _ in range(args.repeat))
+    return results
+
+
+def bench_sync(args, api, board):
+    ress = [api.add_thread("sync", args.replies)
+            for _ in range(args.threads)]
+    b = fourch.Board("sync", client=fourch.Client())
+    b.all_threads(hydrate=True)
+    changed = ress[:max(1, args.threads // 10)]
+    results = {}
+
+    def unchanged():
+        updated = b.sync()
+        assert not updated, updated
+
+    results["sync unchanged ms"] = timed(unchanged, args.repeat) * 1000
+
+    def grow():
+        for res in changed:
+            api.reply("sync", res, args.new)
+        start = time.time()
+        updated = b.sync()
+        took = time.time() - start
+        assert len(updated) == len(changed), updated
+        return took
+
+    took = min(grow() for _ in range(args.repeat))
+    results["sync {0} changed ms".format(len(changed))] = took * 1000
+    return results
+
+
+def bench_memory(args, api, board):
+    cache = fourch.ThreadCache()
+    ress = [api.add_thread("bench", args.replies)
+            for _ in range(args.threads)]
+    bodies = [json.dumps(api.route("/bench/thread/{0}.json".format(r))[0])
+              for r in ress]
+    posts = args.threads * (args.replies + 1)
+    results = {}
+
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    for res, body in zip(ress, bodies):
+        cache[res] = fourch.Thread.from_json(board, fourch.loads(body), res)
+    if tracemalloc is not None:
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results["cache measured KB"] = used / 1024.0
+        results["bytes/post measured"] = float(used) / posts
+    results["cache estimated KB"] = cache.stats()["bytes"] / 1024.0
+    return results
+
+
+def bench_cache(args, api, board):
+    res = api.add_thread("bench", 10)
+    t = board.thread(res, update_cache=False)
+    n = args.cache_threads
+    results = {}
+
+    def fill(cache):
+        start = time.time()
+        for i in range(n):
+            cache[i] = t
+        # Then re-store the newest tenth, as updates do.
+        for i in range(n - n // 10, n):
+            cache[i] = t
+        return time.time() - start
+
+    took = min(fill(fourch.ThreadCache()) for _ in range(args.repeat))
+    results["store unbounded us"] = took / (n + n // 10) * 1e6
+    took = min(fill(fourch.ThreadCache(max_entries=n // 2))
+               for _ in range(args.repeat))
+    results["store max_entries us"] = took / (n + n // 10) * 1e6
+    return results
+
+
+def bench_download(args, api, board):
+    res = api.add_thread("bench", args.images - 1, images=1,
+                         image_size=args.image_size)
+    t = board.thread(res, update_cache=False)
+    folder = tempfile.mkdtemp(prefix="fourch-bench-")
+    try:
+        plan = fourch.MediaPlanner().plan([t.op] + t.replies, folder)
+        d = fourch.Downloader(board.session, concurrency=args.concurrency)
+        start = time.time()
+        done = d.download(plan)
+        took = max(time.time() - start, 1e-9)
+        assert not d.failed, d.failed
+    finally:
+        shutil.rmtree(folder)
+    size = sum(dl.size for dl in plan)
+    return {
+        "download MB/s": size / took / 1e6,
+        "download files/s": done / took,
+    }
+
+
+BENCHMARKS = [
+    ("parse", bench_parse),
+    ("update", bench_update),
+    ("catalog", bench_catalog),
+    ("sync", bench_sync),
+    ("memory", bench_memory),
+    ("cache", bench_cache),
+    ("download", bench_download),
+]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark fourch.")
+    p.add_argument("--only", nargs="+", choices=[n for n, _ in BENCHMARKS],
+                   help="Only run these benchmarks.")
+    p.add_argument("--repeat", type=int, default=5,
+                   help="Runs of each timing; the best is reported."
+                        " (default: %(default)s)")
+    p.add_argument("--replies", type=int, default=300,
+                   help="Replies per thread. (default: %(default)s)")
+    p.add_argument("--new", type=int, default=5,
+                   help="Replies posted between updates."
+                        " (default: %(default)s)")
+    p.add_argument("--threads", type=int, default=50,
+                   help="Threads per board for the catalog, sync and"
+                        " memory benchmarks."
+                        " (default: %(default)s)")
+    p.add_argument("--cache-threads", type=int, default=20000,
+                   help="Threads to store for the cache benchmark."
+                        " (default: %(default)s)")
+    p.add_argument("--images", type=int, default=100,
+                   help="Images to download. (default: %(default)s)")
+    p.add_argument("--image-size", type=int, default=256 * 1024,
+                   help="Bytes per image. (default: %(default)s)")
+    p.add_argument("--concurrency", type=int, default=4,
+                   help="Concurrent downloads. (default: %(default)s)")
+    p.add_argument("--fixtures",
+                   help="A folder of recorded json to serve as well.")
+    p.add_argument("--json", help="Save the results to this file.")
+    p.add_argument("--compare", help="Compare against results saved with"
+                                     " --json.")
+    args = p.parse_args()
+
+    api = server.MockAPI()
+    if args.fixtures:
+        api.load(args.fixtures)
+    _, httpd, host = server.serve(api)
+    server.point(fourch, host)
+    board = fourch.Board("bench", client=fourch.Client())
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print("fourch {0} on Python {1}, json decoder: {2}".format(
+        fourch.__version__, sys.version.split()[0],
+        getattr(fourch.fourch._decoder, "__module__", "?")))
+    results = {}
+    try:
+        for name, bench in BENCHMARKS:
+            if args.only and name not in args.only:
+                continue
+            print("\n{0}:".format(name))
+            for key, value in sorted(bench(args, api, board).items()):
+                results[key] = value
+                line = "  {0:<28} {1:>12.2f}".format(key, value)
+                if key in baseline and baseline[key]:
+                    line += "  ({0:+.1f}%)".format(
+                        (value / baseline[key] - 1) * 100)
+                print(line)
+    finally:
+        httpd.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
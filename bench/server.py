@@ -0,0 +1,351 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+""" A local stand-in for the 4chan API and image servers, for benchmarking
+    fourch without going near the real thing.
+
+    Boards are made of synthetic threads (see :meth:`MockAPI.add_thread`),
+    from which boards.json, threads.json, catalog.json, the board pages and
+    the thread json are all generated on request, with Last-Modified,
+    If-Modified-Since/304 and 404 handled as the real API does. Recorded
+    json can be replayed too (see :meth:`MockAPI.load`). Images are served
+    with Range support.
+
+    Run on its own, it serves a synthetic board until interrupted::
+
+        $ python bench/server.py --port 8080 --threads 50
+"""
+from __future__ import print_function
+
+import base64
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+PER_PAGE = 15
+
+
+class MockAPI(object):
+    """ The state behind the server: the threads on each board, recorded
+        fixtures, and images.
+    """
+
+    def __init__(self):
+        self.threads = {}  # {(board, no): {"posts": [...], "lm": time}}
+        self.fixtures = {}  # {path: (body, last modified)}
+        self.images = {}  # {path: bytes}
+        self.hits = 0
+        self._next_no = 1000
+        self._lock = threading.Lock()
+
+    def add_thread(self, board, replies=50, images=0.5, image_size=1024,
+                   posted=None):
+        """ Make a synthetic thread.
+
+            :param board: the board to put it on
+            :type board: str
+            :param replies: how many replies it has
+            :type replies: int
+            :param images: the fraction of posts with an image
+            :type images: float
+            :param image_size: how big each image is, in bytes
+            :type image_size: int
+            :param posted: when it was posted, as a UNIX timestamp
+            :type posted: int or None
+            :return: the thread's number
+            :rtype: int
+        """
+        posted = posted or int(time.time()) - 10 * (replies + 1)
+        with self._lock:
+            op = self._post(board, 0, posted, True, image_size)
+            posts = [op]
+            every = int(round(1 / images)) if images else 0
+            for i in range(replies):
+                image = bool(every) and i % every == 0
+                posts.append(self._post(board, op["no"], posted + 10 * i,
+                                        image, image_size, quote=op["no"]))
+            op["sub"] = "Thread {0}".format(op["no"])
+            self.threads[(board, op["no"])] = {"posts": posts,
+                                               "lm": int(time.time())}
+        return op["no"]
+
+    def reply(self, board, res, count=1, image=False, image_size=1024):
+        """ Add replies to a thread, bumping its Last-Modified. """
+        with self._lock:
+            th = self.threads[(board, res)]
+            for _ in range(count):
+                th["posts"].append(self._post(board, res, int(time.time()),
+                                              image, image_size, quote=res))
+            th["lm"] = self._bump(board)
+
+    def delete_post(self, board, res, no):
+        """ Delete a post from a thread, bumping its Last-Modified. """
+        with self._lock:
+            th = self.threads[(board, res)]
+            th["posts"] = [p for p in th["posts"] if p["no"] != no]
+            th["lm"] = self._bump(board)
+
+    def _bump(self, board):
+        # Last-Modified only has whole seconds, so move it past every other
+        # thread's on the board, or the board's own Last-Modified (the
+        # newest of them) might not change, and threads.json would 304.
+        return max([int(time.time())] + [th["lm"] + 1 for (b, _), th
+                                         in self.threads.items()
+                                         if b == board])
+
+    def kill(self, board, res):
+        """ 404 a thread. """
+        with self._lock:
+            self.threads.pop((board, res), None)
+
+    def load(self, folder):
+        """ Replay recorded json: every ``.json`` file under the folder is
+            served at its path relative to it (e.g. ``g/thread/123.json``
+            as ``/g/thread/123.json``), with its mtime as Last-Modified.
+            These take precedence over synthetic threads.
+
+            :param folder: the folder of recorded json
+            :type folder: str
+        """
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                url = "/" + os.path.relpath(path, folder).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    self.fixtures[url] = (f.read(),
+                                          int(os.path.getmtime(path)))
+
+    def _post(self, board, resto, posted, image, image_size, quote=None):
+        self._next_no += 1
+        no = self._next_no
+        if quote:
+            com = ('<a href="#p{0}" class="quotelink">&gt;&gt;{0}</a><br>'
+                   '<span class="quote">&gt;implying</span> post {1} is '
+                   '&quot;fast&quot; &amp; correct<br><br>'
+                   'lorem ipsum dolor sit amet, consectetur adipiscing elit'
+                   .format(quote, no))
+        else:
+            com = "Thread {0}<br>welcome &amp; post images".format(no)
+        post = {"no": no, "resto": resto, "time": posted, "now": "now",
+                "name": "Anonymous", "com": com}
+        if image:
+            data = (("img{0}".format(no) * image_size)
+                    [:image_size].encode("ascii"))
+            tim = no * 1000
+            self.images["/{0}/{1}.jpg".format(board, tim)] = data
+            self.images["/{0}/{1}s.jpg".format(board, tim)] = data[:64]
+            post.update({
+                "tim": tim, "filename": "file{0}".format(no), "ext": ".jpg",
+                "fsize": len(data), "w": 500, "h": 500, "tn_w": 125,
+                "tn_h": 125,
+                "md5": base64.b64encode(
+                    hashlib.md5(data).digest()).decode("ascii"),
+            })
+        return post
+
+    def _board(self, board):
+        """ A board's threads, most recently modified first. """
+        return sorted(((no, th) for (b, no), th in self.threads.items()
+                       if b == board),
+                      key=lambda i: -i[1]["lm"])
+
+    def _preview(self, th, omitted=True):
+        op = dict(th["posts"][0])
+        last = th["posts"][1:][-5:]
+        op["replies"] = len(th["posts"]) - 1
+        op["images"] = sum(1 for p in th["posts"][1:] if "tim" in p)
+        if omitted:
+            op["omitted_posts"] = op["replies"] - len(last)
+            op["omitted_images"] = op["images"] - sum(1 for p in last
+                                                      if "tim" in p)
+        return op, last
+
+    def route(self, path):
+        """ Work out the response to an API request.
+
+            :return: (json, last modified), or None for a 404
+            :rtype: tuple or None
+        """
+        if path == "/boards.json":
+            boards = sorted(set(b for b, _ in self.threads)) or ["g"]
+            return {"boards": [{"board": b} for b in boards]}, 1
+
+        parts = path.strip("/").split("/")
+        if len(parts) < 2:
+            return None
+        with self._lock:
+            if parts[1] == "thread" and len(parts) == 3:
+                th = self.threads.get((parts[0],
+                                       int(parts[2].split(".")[0])))
+                if th is None:
+                    return None
+                op, _ = self._preview(th, omitted=False)
+                return {"posts": [op] + th["posts"][1:]}, th["lm"]
+
+            threads = self._board(parts[0])
+            lm = max([th["lm"] for _, th in threads] or [1])
+            pages = [threads[i:i + PER_PAGE]
+                     for i in range(0, len(threads), PER_PAGE)]
+
+            if parts[1] == "threads.json":
+                return [{"page": i + 1,
+                         "threads": [{"no": no, "last_modified": th["lm"]}
+                                     for no, th in page]}
+                        for i, page in enumerate(pages)], lm
+
+            if parts[1] == "catalog.json":
+                catalog = []
+                for i, page in enumerate(pages):
+                    ops = []
+                    for no, th in page:
+                        op, last = self._preview(th)
+                        op["last_replies"] = last
+                        op["last_modified"] = th["lm"]
+                        ops.append(op)
+                    catalog.append({"page": i + 1, "threads": ops})
+                return catalog, lm
+
+            try:
+                page = int(parts[1].split(".")[0])
+            except ValueError:
+                return None
+            if not 1 <= page <= len(pages):
+                return None
+            previews = []
+            for _, th in pages[page - 1]:
+                op, last = self._preview(th)
+                previews.append({"posts": [op] + last})
+            return {"threads": previews}, lm
+
+
+def _http_date(t):
+    return email.utils.formatdate(t, usegmt=True)
+
+
+def _handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Send each response in one go, rather than a write per header,
+        # which runs into delayed ACKs on keep-alive connections.
+        wbufsize = -1
+
+        def log_message(self, *args):
+            pass
+
+        def do_HEAD(self):
+            self.do_GET()
+
+        def do_GET(self):
+            api.hits += 1
+            path = self.path.split("?")[0]
+            if path in api.images:
+                return self._image(api.images[path])
+
+            if path in api.fixtures:
+                body, lm = api.fixtures[path]
+            else:
+                found = api.route(path)
+                if found is None:
+                    return self._send(404)
+                obj, lm = found
+                body = None
+
+            ims = self.headers.get("If-Modified-Since")
+            if ims:
+                parsed = email.utils.parsedate_tz(ims)
+                if parsed and lm <= email.utils.mktime_tz(parsed):
+                    return self._send(304, lm=lm)
+            if body is None:
+                body = json.dumps(obj).encode("utf-8")
+            self._send(200, body, lm=lm,
+                       headers={"Content-Type": "application/json"})
+
+        def _image(self, data):
+            rng = self.headers.get("Range")
+            if rng:
+                start = int(rng.split("=")[1].split("-")[0])
+                if start >= len(data):
+                    return self._send(416)
+                return self._send(206, data[start:], headers={
+                    "Content-Range": "bytes {0}-{1}/{2}".format(
+                        start, len(data) - 1, len(data))})
+            self._send(200, data, headers={"Content-Type": "image/jpeg"})
+
+        def _send(self, code, body=b"", lm=None, headers=None):
+            self.send_response(code)
+            if lm is not None:
+                self.send_header("Last-Modified", _http_date(lm))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+            self.wfile.flush()
+
+    return Handler
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(api=None, port=0):
+    """ Start serving in a background thread.
+
+        :param api: the state to serve, a new one if not given
+        :type api: :class:`MockAPI` or None
+        :param port: the port to listen on, any free one if 0
+        :type port: int
+        :return: (the state, the server, 'host:port')
+        :rtype: tuple
+    """
+    api = api or MockAPI()
+    server = _Server(("127.0.0.1", port), _handler(api))
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return api, server, "127.0.0.1:{0}".format(server.server_address[1])
+
+
+def point(fourch, host):
+    """ Send all of fourch's requests to the given host instead. """
+    for key in ("api", "boards", "images", "thumbs"):
+        fourch.urls[key] = host
+
+
+if __name__ == "__main__":
+    import argparse
+
+    p = argparse.ArgumentParser(description="Serve a mock 4chan API.")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--board", default="g")
+    p.add_argument("--threads", type=int, default=50)
+    p.add_argument("--replies", type=int, default=100)
+    p.add_argument("--fixtures",
+                   help="A folder of recorded json to replay.")
+    args = p.parse_args()
+
+    api = MockAPI()
+    for _ in range(args.threads):
+        api.add_thread(args.board, args.replies)
+    if args.fixtures:
+        api.load(args.fixtures)
+    _, server, host = serve(api, args.port)
+    print("Serving /{0}/ on http://{1}/".format(args.board, host))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
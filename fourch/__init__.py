@@ -10,35 +10,46 @@
 """
 from ._version import __version__
 
-from .fourch import urls
+from .fourch import (urls, loads, set_decoder, iter_threads,
+                     thread_parser)
 
-from .thread import Thread
+from .thread import Thread, ThreadDelta
 from .board import Board
-from .reply import Reply
-
-import requests
-
-
-def boards(https=False):
+from .reply import Reply, FileInfo
+from .cache import ThreadCache
+from .client import Client, default_client, get_json
+from .metrics import Metrics
+from .store import SQLiteStore
+from .download import Download, Downloader, ChecksumError
+from .archive import ArchiveStore
+from .media import MediaPlanner
+from .search import SearchIndex
+from .ratelimit import RateLimiter, SharedRateLimiter
+from .scheduler import Scheduler
+from .export import Exporter
+from .archiver import BoardArchiver
+
+# {url: (last modified, json)} -- for boards.json
+_boards_cache = {}
+
+
+def boards(https=False, client=None):
     """ Get a list of all boards on 4chan, in :class:`fourch.board.Board`
         objects.
 
         :param https: Should we use HTTPS or HTTP?
         :type https: bool
+        :param client: what to send requests through, the process-wide
+                       :class:`fourch.Client` if not given
+        :type client: :class:`fourch.Client` or None
     """
-    s = requests.Session()
-    s.headers.update({
-        "User-Agent": "fourch/{0} (@https://github.com/sysr-q/4ch)".format(
-            __version__
-        )
-    })
+    if client is None:
+        client = default_client()
     proto = "https://" if https else "http://"
     url = proto + urls['api'] + urls["api_boards"]
-    r = s.get(url)
-    if r.status_code != requests.codes.ok:
-        r.raise_for_status()
+    json = get_json(client, url, _boards_cache)[0]
 
     boards = []
-    for json_board in r.json()['boards']:
-        boards.append(Board(json_board['board'], https=https))
+    for json_board in json['boards']:
+        boards.append(Board(json_board['board'], https=https, client=client))
     return boards
@@ -0,0 +1,347 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+""" asyncio flavoured versions of :class:`fourch.Board` and
+    :class:`fourch.Thread`, built on top of aiohttp.
+
+    Every network call is a coroutine, and all requests from a board go
+    through one pooled connector, so a single process can keep thousands of
+    threads in flight at once. Since they don't go through a
+    :class:`fourch.Client`, those requests aren't recorded in its
+    :class:`fourch.Metrics`.
+
+    This needs Python 3.6+ and aiohttp, so it isn't imported by ``fourch``
+    itself; use ``from fourch.aio import AsyncBoard``.
+"""
+import asyncio
+
+import aiohttp
+
+import fourch
+from .board import Board
+from .thread import Thread, ThreadDelta
+
+
+def _headers():
+    uaf = "fourch/{0} (@https://github.com/sysr-q/4ch)"
+    return {"User-Agent": uaf.format(fourch.__version__)}
+
+
+async def boards(https=False, session=None):
+    """ Get a list of all boards on 4chan, in :class:`AsyncBoard` objects.
+
+        :param https: Should we use HTTPS or HTTP?
+        :type https: bool
+        :param session: a session to send the request through, if not given
+                        a throwaway one is used
+        :type session: aiohttp.ClientSession or None
+    """
+    proto = "https://" if https else "http://"
+    url = proto + fourch.urls["api"] + fourch.urls["api_boards"]
+
+    if session is None:
+        async with aiohttp.ClientSession(headers=_headers()) as s:
+            return await boards(https=https, session=s)
+
+    async with session.get(url) as r:
+        r.raise_for_status()
+        json = await r.json(loads=fourch.loads, content_type=None)
+    return [AsyncBoard(b["board"], https=https) for b in json["boards"]]
+
+
+class AsyncThread(Thread):
+    """ A :class:`fourch.Thread` whose :meth:`update` is a coroutine.
+    """
+
+    async def update(self, force=False):
+        """ Update the thread, pulling in new replies,
+            appending them to the reply pool.
+
+            :param force: should replies be replaced with fresh reply objects
+            :type force: bool
+            :return: what changed, which is also the number of new replies
+            :rtype: :class:`fourch.ThreadDelta`
+        """
+        if not self.alive and not force:
+            return ThreadDelta()
+
+        url = self._board.url("api_thread",
+                              board=self._board.name,
+                              thread=self.res)
+        async with self._board.session.get(url,
+                                           headers=self._headers()) as r:
+            if r.status == 304:
+                # 304 Not Modified
+                return ThreadDelta()
+
+            elif r.status == 404:
+                # 404 Not Found
+                self._died()
+                return ThreadDelta(died=True)
+
+            elif r.status == 200:
+                json = await r.json(loads=fourch.loads, content_type=None)
+                return self._apply(json["posts"],
+                                   r.headers["last-modified"],
+                                   force=force)
+
+            else:
+                r.raise_for_status()
+
+
+class AsyncBoard(Board):
+    """ A :class:`fourch.Board` whose network calls are all coroutines.
+
+        The board owns an aiohttp session, so it should be closed when you're
+        done with it, either with :meth:`close` or ``async with``.
+    """
+
+    _thread_class = AsyncThread
+
+    def __init__(self, name, https=False, cache=None, store=None,
+                 limit=100):
+        """ Create the board instance, and initialize internal variables.
+
+            :param name: The board name, minus slashes. e.g., 'b', 'x', 'tv'
+            :type name: string
+            :param https: Should we use HTTPS or HTTP?
+            :type https: bool
+            :param cache: where to keep prefetched threads
+            :type cache: :class:`fourch.ThreadCache` or dict
+            :param store: where to persist threads between runs, if anywhere
+            :type store: :class:`fourch.SQLiteStore` or None
+            :param limit: the most connections to keep open at once
+            :type limit: int
+        """
+        super(AsyncBoard, self).__init__(name,
+                                         https=https,
+                                         cache=cache,
+                                         store=store)
+        self.limit = limit
+
+    @property
+    def session(self):
+        # This has to be made from inside a running event loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                headers=_headers()
+            )
+        return self._session
+
+    async def close(self):
+        """ Close the board's session, and all of its pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _json(self, url):
+        """ GET and decode a json endpoint, revalidating what's already in
+            :attr:`_endpoints` with If-Modified-Since, as
+            :func:`fourch.get_json` does.
+
+            :param url: the url to fetch
+            :type url: str
+            :return: the decoded json, and its Last-Modified header
+            :rtype: tuple
+        """
+        cached = self._endpoints.get(url)
+        headers = None
+        if cached is not None:
+            headers = {"If-Modified-Since": cached[0]}
+
+        async with self.session.get(url, headers=headers) as r:
+            if cached is not None and r.status == 304:
+                return cached[1], cached[0]
+            r.raise_for_status()
+            json = await r.json(loads=fourch.loads, content_type=None)
+            last_modified = r.headers.get("last-modified")
+
+        if last_modified:
+            self._endpoints[url] = (last_modified, json)
+        else:
+            self._endpoints.pop(url, None)
+        return json, last_modified
+
+    async def catalog(self):
+        """ Get a list of all the thread OPs and last replies. If it hasn't
+            changed since the last call, the same (shared) object is
+            returned.
+        """
+        url = self.url("api_catalog", board=self.name)
+        return (await self._json(url))[0]
+
+    async def iter_catalog(self):
+        """ Like :meth:`catalog`, but stream the catalog, yielding each
+            thread's json as soon as it has been read.
+
+            :return: an async generator yielding the json of each thread
+            :rtype: async generator
+        """
+        url = self.url("api_catalog", board=self.name)
+        parser = fourch.thread_parser()
+        async with self.session.get(url) as r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_chunked(self.chunk_size):
+                for thj in parser.send(chunk):
+                    yield thj
+
+    async def threads(self):
+        """ Get a list of all the threads alive, and which page they're on.
+        """
+        url = self.url("api_threads", board=self.name)
+        return (await self._json(url))[0]
+
+    async def sync(self):
+        """ Bring all cached threads up to date from a single fetch of
+            :meth:`threads`, as :meth:`fourch.Board.sync` does, updating the
+            changed threads concurrently.
+
+            :return: the threads which were updated
+            :rtype: list
+        """
+        index = {}
+        for page in await self.threads():
+            for thj in page["threads"]:
+                index[thj["no"]] = thj["last_modified"]
+
+        updated = []
+        # Dead threads are dropped from the cache as we go.
+        for res, t in list(self._cache.items()):
+            modified = index.get(int(res))
+            if modified is None:
+                t._died()
+                continue
+
+            known = t.last_modified
+            partial = t.omitted_posts or t.omitted_images
+            if partial or known is None or modified > known:
+                updated.append(t)
+
+        await asyncio.gather(*[t.update() for t in updated])
+        return updated
+
+    async def thread(self, res, update_cache=True):
+        """ Create a :class:`AsyncThread` object.
+            If the thread has already been fetched, return the cached thread.
+
+            :param res: the thread number to fetch
+            :type res: str or int
+            :param update_cache: should we update if it's cached?
+            :type update_cache: bool
+            :return: the :class:`AsyncThread` object
+            :rtype: :class:`AsyncThread` or None
+        """
+        t = self._cache.get(res)
+        if t is None:
+            t = self._restore(res)
+            if t is not None and not t.alive:
+                return None
+        if t is not None:
+            if update_cache:
+                await t.update()
+            return t
+
+        url = self.url("api_thread", board=self.name, thread=res)
+
+        async with self.session.get(url) as r:
+            if r.status == 404:
+                return None
+            r.raise_for_status()
+            json = await r.json(loads=fourch.loads, content_type=None)
+            last_modified = r.headers["last-modified"]
+
+        t = self._thread_class.from_json(self,
+                                         json,
+                                         res=res,
+                                         last_modified=last_modified)
+        self._cache[res] = t
+        t._save()
+        t._index()
+        return t
+
+    async def page(self, page=1, update_each=False):
+        """ Return all the threads in a single page.
+            The page number is one-indexed. First page is 1, second is 2, etc.
+
+            :param page: page to pull threads from
+            :type page: int
+            :param update_each: should each thread be updated, to pull all
+                                replies; the updates run concurrently
+            :type update_each: bool
+            :return: a list of :class:`AsyncThread` objects, corresponding to
+                     all threads on given page
+            :rtype: list
+        """
+        url = self.url("api_board", board=self.name, page=page)
+        json, last_modified = await self._json(url)
+
+        threads = self._threads_from_page(json, last_modified)
+        if update_each:
+            await asyncio.gather(*[t.update() for t in threads])
+        return threads
+
+    async def iter_page(self, page=1):
+        """ Like :meth:`page`, but stream the page, yielding each
+            :class:`AsyncThread` as soon as it has been read.
+
+            :param page: page to pull threads from
+            :type page: int
+            :return: an async generator yielding :class:`AsyncThread` objects
+            :rtype: async generator
+        """
+        url = self.url("api_board", board=self.name, page=page)
+        parser = fourch.thread_parser()
+        async with self.session.get(url) as r:
+            r.raise_for_status()
+            last_modified = r.headers["last-modified"]
+            async for chunk in r.content.iter_chunked(self.chunk_size):
+                for thj in parser.send(chunk):
+                    yield self._thread_from_page(thj, last_modified)
+
+    async def all_threads(self, hydrate=False):
+        """ Return every thread on the board, from a single fetch of the
+            catalog, as :meth:`fourch.Board.all_threads` does. With
+            ``hydrate``, every thread is then updated concurrently.
+
+            :param hydrate: should each thread be updated, to pull all
+                            replies
+            :type hydrate: bool
+            :return: a list of :class:`AsyncThread` objects, in catalog
+                     order
+            :rtype: list
+        """
+        url = self.url("api_catalog", board=self.name)
+        json, last_modified = await self._json(url)
+
+        threads = self._threads_from_catalog(json, last_modified)
+        if hydrate:
+            await asyncio.gather(*[t.update() for t in threads])
+        return threads
+
+    async def media_manifest(self):
+        """ List every file on the board, from a single fetch of the
+            catalog. See :meth:`fourch.Board.media_manifest`.
+
+            :return: ``(thread number, post number, file)`` for every post
+                     with a file, in catalog order
+            :rtype: list of tuple
+        """
+        return self._manifest(await self.catalog())
+
+    async def thread_exists(self, res):
+        """ Figure out whether or not a thread exists.
+
+            :param res: the thread number to fetch
+            :type res: str or int
+            :return: whether or not the given thread exists
+            :rtype: bool
+        """
+        url = self.url("api_thread", board=self.name, thread=res)
+        async with self.session.head(url) as r:
+            return r.status == 200
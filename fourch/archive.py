@@ -0,0 +1,88 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import binascii
+import errno
+import os
+import shutil
+
+
+class ArchiveStore(object):
+    """ A content-addressed store of downloaded files, keyed by the MD5 4chan
+        gives for each post's file.
+
+        Each file is kept once, under ``root/ab/abcdef....ext``, and linked
+        into every thread folder it's posted in, so a reposted image is only
+        ever downloaded (and stored) once across all threads and boards.
+    """
+
+    def __init__(self, root):
+        """ :param root: the folder to keep files in
+            :type root: str
+        """
+        self.root = os.path.expanduser(root)
+
+    def __repr__(self):
+        return "<{0} {1}>".format(self.__class__.__name__, self.root)
+
+    def path(self, md5, extension=""):
+        """ Where the file with the given MD5 is kept.
+
+            :param md5: the file's (raw) MD5, as in :attr:`fourch.Reply.file`
+            :type md5: bytes
+            :param extension: the file's extension, e.g. '.jpg'
+            :type extension: str
+            :return: the path of the stored file
+            :rtype: str
+        """
+        digest = binascii.hexlify(md5).decode("ascii")
+        return os.path.join(self.root, digest[:2], digest + extension)
+
+    def has(self, md5, extension=""):
+        """ Is the file with the given MD5 already stored?
+
+            :rtype: bool
+        """
+        return os.path.exists(self.path(md5, extension))
+
+    def add(self, md5, src, extension=""):
+        """ Store a downloaded file, linking it in rather than copying it
+            where possible. If it's already stored, nothing is done.
+
+            :param md5: the file's (raw) MD5
+            :type md5: bytes
+            :param src: where the file was downloaded to
+            :type src: str
+            :param extension: the file's extension
+            :type extension: str
+        """
+        path = self.path(md5, extension)
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        _link(src, path)
+
+    def link(self, md5, dest, extension=""):
+        """ Put the stored file with the given MD5 at ``dest``, as a hard
+            link if the filesystem allows it, or a copy if not.
+
+            :param md5: the file's (raw) MD5
+            :type md5: bytes
+            :param dest: where to put the file
+            :type dest: str
+            :param extension: the file's extension
+            :type extension: str
+        """
+        _link(self.path(md5, extension), dest)
+
+
+def _link(src, dest):
+    try:
+        os.link(src, dest)
+    except (AttributeError, OSError) as e:
+        # No hard links on this platform, or across these filesystems.
+        if getattr(e, "errno", None) == errno.EEXIST:
+            return
+        shutil.copyfile(src, dest)
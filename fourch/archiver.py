@@ -0,0 +1,275 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import errno
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import requests
+
+from .archive import ArchiveStore
+from .board import Board
+from .client import Client
+from .download import Downloader
+from .media import MediaPlanner
+from .ratelimit import SharedRateLimiter
+
+# Counters shared between the parent and workers, as indices into an array.
+_FILES, _LINKED, _FAILED = range(3)
+
+# Per-process state of a worker, set up by _init_worker.
+_worker = {}
+
+
+class BoardArchiver(object):
+    """ Archives whole boards using a pool of worker processes, so JSON
+        decoding, comment rendering and hashing are spread over every core
+        rather than held up by one process's GIL.
+
+        Each board's threads (from :meth:`fourch.Board.threads`) are sharded
+        across the workers, which fetch each thread and its files. All the
+        workers share one request budget, one bandwidth budget, and one set
+        of the files being fetched by MD5, so a file posted in threads on
+        different workers is still only downloaded once. Without a store,
+        files are deduped through a scratch one next to the output, which is
+        removed once the boards are archived. Progress is collected in the
+        parent.
+    """
+
+    def __init__(self, out="~/4ch/{board}/{thread}", processes=None,
+                 concurrency=4, store=None, rate=1.0, byte_rate=None,
+                 per_host=None, planner=None, json=False, https=False,
+                 progress=None):
+        """ :param out: the folder to put each thread in; '{board}' and
+                        '{thread}' are filled in
+            :type out: str
+            :param processes: how many worker processes to run, one per core
+                              if not given
+            :type processes: int or None
+            :param concurrency: how many files each worker fetches at once
+            :type concurrency: int
+            :param store: the folder of a :class:`fourch.ArchiveStore` to
+                          keep files in, and dedupe them against; a scratch
+                          one is used for each run if not given
+            :type store: str or None
+            :param rate: the most thread requests to send per second, across
+                         every worker
+            :type rate: int or float
+            :param byte_rate: the most bytes to download per second, across
+                              every worker
+            :type byte_rate: int or None
+            :param per_host: the most files each worker fetches from any one
+                             host at once
+            :type per_host: int or None
+            :param planner: what decides which files to fetch
+            :type planner: :class:`fourch.MediaPlanner` or None
+            :param json: store each thread's json as thread.json
+            :type json: bool
+            :param https: Should we use HTTPS or HTTP?
+            :type https: bool
+            :param progress: called in the parent as ``progress(stats)``,
+                             with :meth:`stats`, every time a thread is done
+            :type progress: callable or None
+        """
+        self.out = out
+        self.processes = processes or multiprocessing.cpu_count()
+        self.concurrency = concurrency
+        self.store = store
+        self.rate = rate
+        self.byte_rate = byte_rate
+        self.per_host = per_host
+        self.planner = planner if planner is not None else MediaPlanner()
+        self.json = json
+        self.https = https
+        self.progress = progress
+
+        self.threads = 0
+        self.total = 0
+        self.dead = 0
+        self.errors = 0
+        self.posts = 0
+        self._counters = multiprocessing.Array("l", 3)
+
+    def __repr__(self):
+        return "<{0} {1} processes>".format(
+            self.__class__.__name__,
+            self.processes
+        )
+
+    def stats(self):
+        """ Get the progress so far.
+
+            :return: threads ``done`` out of ``total``, how many had 404'd
+                     (``dead``) or couldn't be fetched or saved
+                     (``errors``), ``posts`` seen, and ``files`` handled, of
+                     which ``linked`` from the store and ``failed``
+            :rtype: dict
+        """
+        with self._counters.get_lock():
+            files, linked, failed = self._counters[:]
+        return {
+            "done": self.threads,
+            "total": self.total,
+            "dead": self.dead,
+            "errors": self.errors,
+            "posts": self.posts,
+            "files": files,
+            "linked": linked,
+            "failed": failed,
+        }
+
+    def archive(self, boards):
+        """ Archive every live thread on the given boards, blocking until
+            it's done.
+
+            :param boards: the boards' names, e.g. ['g', 'x']
+            :type boards: list
+            :return: the final :meth:`stats`
+            :rtype: dict
+        """
+        tasks = []
+        for name in boards:
+            board = Board(name, https=self.https)
+            for page in board.threads():
+                tasks.extend((name, th["no"]) for th in page["threads"])
+        self.total += len(tasks)
+        if not tasks:
+            return self.stats()
+
+        store, scratch = self.store, None
+        if store is None:
+            # Files are hard linked (or copied) out of the store into each
+            # thread's folder, so they outlive it.
+            store = scratch = tempfile.mkdtemp(prefix=".fourch-",
+                                               dir=self._root())
+        manager = multiprocessing.Manager()
+        try:
+            settings = {
+                "out": self.out,
+                "https": self.https,
+                "concurrency": self.concurrency,
+                "per_host": self.per_host,
+                "store": store,
+                "planner": self.planner,
+                "json": self.json,
+            }
+            limiter = SharedRateLimiter(self.rate)
+            byte_limiter = None
+            if self.byte_rate:
+                byte_limiter = SharedRateLimiter(self.byte_rate,
+                                                 burst=self.byte_rate)
+            pool = multiprocessing.Pool(
+                min(self.processes, len(tasks)),
+                _init_worker,
+                (settings, limiter, byte_limiter, manager.dict(),
+                 self._counters))
+            try:
+                for status, posts in pool.imap_unordered(_archive_thread,
+                                                         tasks):
+                    self.threads += 1
+                    self.posts += posts
+                    if status == "dead":
+                        self.dead += 1
+                    elif status == "error":
+                        self.errors += 1
+                    if self.progress is not None:
+                        self.progress(self.stats())
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        finally:
+            manager.shutdown()
+            if scratch is not None:
+                shutil.rmtree(scratch, ignore_errors=True)
+        return self.stats()
+
+    def _root(self):
+        """ The folder every thread's folder goes in, made if need be, so a
+            scratch store there is on the same filesystem as the output.
+        """
+        root = os.path.dirname(os.path.expanduser(self.out.split("{")[0]))
+        root = root or "."
+        try:
+            os.makedirs(root)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return root
+
+
+def _init_worker(settings, limiter, byte_limiter, claims, counters):
+    # Connections can't be shared with the parent, so each worker gets its
+    # own client.
+    _worker.update(settings)
+    _worker["client"] = Client()
+    _worker["boards"] = {}
+    _worker["limiter"] = limiter
+    _worker["byte_limiter"] = byte_limiter
+    _worker["claims"] = claims
+    _worker["counters"] = counters
+    if settings["store"]:
+        _worker["store"] = ArchiveStore(settings["store"])
+
+
+def _count(counter, amount=1):
+    counters = _worker["counters"]
+    with counters.get_lock():
+        counters[counter] += amount
+
+
+def _archive_thread(task):
+    """ Fetch a thread and its files, in a worker.
+
+        :return: 'done', 'dead' (it 404'd) or 'error' (it couldn't be
+                 fetched or saved), and how many posts the thread has
+        :rtype: tuple
+    """
+    name, res = task
+    board = _worker["boards"].get(name)
+    if board is None:
+        board = _worker["boards"][name] = Board(name,
+                                                https=_worker["https"],
+                                                client=_worker["client"])
+
+    _worker["limiter"].acquire()
+    try:
+        t = board.thread(res, update_cache=False)
+    except (requests.RequestException, ValueError):
+        return "error", 0
+    if t is None or not t.alive:
+        return "dead", 0
+    # Workers see each thread once, so don't hold on to it.
+    board._cache.pop(res, None)
+
+    out = os.path.expanduser(
+        _worker["out"].format(board=name, thread=t.op.number))
+    try:
+        if not os.path.isdir(out):
+            try:
+                os.makedirs(out)
+            except OSError:
+                if not os.path.isdir(out):
+                    raise
+        if _worker["json"]:
+            with open(os.path.join(out, "thread.json"), "w") as f:
+                json.dump({"op": t.op._json,
+                           "replies": [r._json for r in t.replies]}, f)
+    except (IOError, OSError):
+        # e.g. out of disk space; the other threads may still fit.
+        return "error", 0
+
+    d = Downloader(board.session,
+                   concurrency=_worker["concurrency"],
+                   store=_worker.get("store"),
+                   limiter=_worker["byte_limiter"],
+                   per_host=_worker["per_host"],
+                   claims=_worker["claims"])
+    files = d.download(_worker["planner"].plan([t.op] + t.replies, out))
+    _count(_FILES, files)
+    _count(_LINKED, d.linked)
+    _count(_FAILED, len(d.failed))
+    return "done", len(t.replies) + 1
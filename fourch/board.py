@@ -1,6 +1,12 @@
 # vim: sw=4 expandtab softtabstop=4 autoindent
+from multiprocessing.pool import ThreadPool
+
 import requests
 import fourch
+from .cache import ThreadCache
+from .client import default_client, get_json
+from .reply import FileInfo
+from .search import SearchIndex
 from .thread import Thread
 
 
@@ -9,18 +15,41 @@ class Board(object):
         creation of thread objects.
     """
 
-    def __init__(self, name, https=False):
+    # What kind of thread objects this board creates.
+    _thread_class = Thread
+    # How much of a streamed response to read at once.
+    chunk_size = 16 * 1024
+
+    def __init__(self, name, https=False, cache=None, store=None,
+                 client=None):
         """ Create the board instance, and initialize internal variables.
 
             :param name: The board name, minus slashes. e.g., 'b', 'x', 'tv'
             :type name: string
             :param https: Should we use HTTPS or HTTP?
             :type https: bool
+            :param cache: where to keep prefetched threads, an unbounded
+                          :class:`fourch.ThreadCache` if not given
+            :type cache: :class:`fourch.ThreadCache` or dict
+            :param store: where to persist threads between runs, if anywhere
+            :type store: :class:`fourch.SQLiteStore` or None
+            :param client: what to send requests through, the process-wide
+                           :class:`fourch.Client` if not given
+            :type client: :class:`fourch.Client` or None
         """
         self.name = name
         self.https = https
-        self._session = None
-        self._cache = {}  # {id: fourch.Thread(id)} -- prefetched threads
+        self._session = client
+        if cache is None:
+            cache = ThreadCache()
+        if getattr(cache, "on_evict", False) is None:
+            cache.on_evict = self._evicted
+        self._cache = cache  # {id: fourch.Thread(id)} -- prefetched threads
+        self._store = store
+        # {url: (last modified, json)} -- for catalog, threads and pages
+        self._endpoints = {}
+        # Made on the first search(), and kept up to date from then on.
+        self._index = None
 
     def __repr__(self):
         # TODO: Fetch title/nsfw status from /boards.
@@ -32,11 +61,7 @@ class Board(object):
     @property
     def session(self):
         if self._session is None:
-            self._session = requests.Session()
-            uaf = "fourch/{0} (@https://github.com/sysr-q/4ch)"
-            self._session.headers.update({
-                "User-agent": uaf.format(fourch.__version__),
-            })
+            self._session = default_client()
         return self._session
 
     @property
@@ -51,10 +76,29 @@ class Board(object):
 
     def catalog(self):
         """ Get a list of all the thread OPs and last replies.
+
+            The catalog is revalidated with If-Modified-Since, and if it
+            hasn't changed the same (shared) object as last time is returned,
+            so don't modify it.
         """
         url = self.url("api_catalog", board=self.name)
-        r = self.session.get(url)
-        return r.json()
+        return get_json(self.session, url, self._endpoints)[0]
+
+    def iter_catalog(self):
+        """ Like :meth:`catalog`, but stream the catalog, yielding each
+            thread's json as soon as it has been read.
+
+            :return: a generator yielding the json of each thread
+            :rtype: generator
+        """
+        url = self.url("api_catalog", board=self.name)
+        r = self.session.get(url, stream=True)
+        try:
+            r.raise_for_status()
+            for thj in fourch.iter_threads(r.iter_content(self.chunk_size)):
+                yield thj
+        finally:
+            r.close()
 
     def threads(self):
         """ Get a list of all the threads alive, and which page they're on.
@@ -63,8 +107,75 @@ class Board(object):
             page it's on at the time of calling.
         """
         url = self.url("api_threads", board=self.name)
-        r = self.session.get(url)
-        return r.json()
+        return get_json(self.session, url, self._endpoints)[0]
+
+    def sync(self):
+        """ Bring all cached threads up to date, using a single fetch of
+            :meth:`threads` to figure out which of them actually changed.
+
+            Threads whose ``last_modified`` in the index is newer than what
+            we last fetched (or which are missing omitted posts, from a
+            page) are updated. Threads missing from the index are marked as
+            404'd and dropped from the cache, without a request each.
+
+            :return: the threads which were updated
+            :rtype: list
+        """
+        index = {}
+        for page in self.threads():
+            for thj in page["threads"]:
+                index[thj["no"]] = thj["last_modified"]
+
+        updated = []
+        # Dead threads are dropped from the cache as we go.
+        for res, t in list(self._cache.items()):
+            modified = index.get(int(res))
+            if modified is None:
+                t._died()
+                continue
+
+            known = t.last_modified
+            partial = t.omitted_posts or t.omitted_images
+            if partial or known is None or modified > known:
+                t.update()
+                updated.append(t)
+
+        return updated
+
+    def comment_texts(self):
+        """ Get the plain text comments of every cached thread.
+            See :meth:`fourch.Thread.comment_texts`.
+
+            :return: ``{thread number: [comment, ...]}``
+            :rtype: dict
+        """
+        return dict((res, t.comment_texts()) for res, t in self._cache.items())
+
+    def _evicted(self, res, thread):
+        """ Forget a thread the cache has let go of, so the search index
+            doesn't keep it (and all its replies) alive.
+        """
+        thread._unindex()
+
+    def search(self, query):
+        """ Search the subjects and comments of every thread fetched on this
+            board for the given terms and "quoted phrases".
+            See :meth:`fourch.SearchIndex.search`.
+
+            The index is built from the cached threads on the first search,
+            and after that kept up to date as threads are fetched and
+            updated, so it only ever does work for new posts.
+
+            :param query: the search query, e.g. 'linux "year of the desktop"'
+            :type query: str
+            :return: the matching replies, by thread and then post number
+            :rtype: list of :class:`fourch.Reply`
+        """
+        if self._index is None:
+            self._index = SearchIndex()
+            for t in self._cache.values():
+                t._index()
+        return self._index.search(query)
 
     def thread(self, res, update_cache=True):
         """ Create a :class:`fourch.thread` object.
@@ -77,8 +188,12 @@ class Board(object):
             :return: the :class:`fourch.Thread` object
             :rtype: :class:`fourch.Thread` or None
         """
-        if res in self._cache:
-            t = self._cache[res]
+        t = self._cache.get(res)
+        if t is None:
+            t = self._restore(res)
+            if t is not None and not t.alive:
+                return None
+        if t is not None:
             if update_cache:
                 t.update()
             return t
@@ -86,9 +201,36 @@ class Board(object):
         url = self.url("api_thread", board=self.name, thread=res)
 
         r = self.session.get(url)
-        t = Thread.from_req(self, res, r)
+        t = self._thread_class.from_req(self, res, r)
         if t is not None:
             self._cache[res] = t
+            t._save()
+            t._index()
+        return t
+
+    def _restore(self, res):
+        """ Load a thread out of the board's store, and into the cache.
+
+            :param res: the thread number to load
+            :type res: str or int
+            :return: the stored thread, or None if it isn't stored
+            :rtype: :class:`fourch.Thread` or None
+        """
+        if self._store is None:
+            return None
+        saved = self._store.load_thread(self.name, res)
+        if saved is None:
+            return None
+
+        t = self._thread_class.from_json(self,
+                                         {"posts": saved["posts"]},
+                                         res=res,
+                                         last_modified=saved["last_modified"])
+        t.alive = saved["alive"]
+        t._stored = True
+        if t.alive:
+            self._cache[res] = t
+            t._index()
         return t
 
     def page(self, page=1, update_each=False):
@@ -108,32 +250,163 @@ class Board(object):
             :rtype: list
         """
         url = self.url("api_board", board=self.name, page=page)
-        r = self.session.get(url)
-        if r.status_code != requests.codes.ok:
+        json, last_modified = get_json(self.session, url, self._endpoints)
+
+        threads = self._threads_from_page(json, last_modified)
+        if update_each:
+            for t in threads:
+                t.update()
+        return threads
+
+    def iter_page(self, page=1):
+        """ Like :meth:`page`, but stream the page, yielding each
+            :class:`fourch.Thread` as soon as it has been read.
+
+            :param page: page to pull threads from
+            :type page: int
+            :return: a generator yielding :class:`fourch.Thread` objects
+            :rtype: generator
+        """
+        url = self.url("api_board", board=self.name, page=page)
+        r = self.session.get(url, stream=True)
+        try:
             r.raise_for_status()
+            last_modified = r.headers["last-modified"]
+            for thj in fourch.iter_threads(r.iter_content(self.chunk_size)):
+                yield self._thread_from_page(thj, last_modified)
+        finally:
+            r.close()
 
-        json = r.json()
-        threads = []
+    def all_threads(self, hydrate=False, workers=4):
+        """ Return every thread on the board, from a single fetch of the
+            catalog. As with :meth:`page`, cached threads are returned rather
+            than making new ones, and new threads are cached.
 
-        for thj in json["threads"]:
-            t = None
-            res = thj["posts"][0]["no"]
+            Threads made from the catalog only have their last few replies,
+            so pass ``hydrate`` to update them all (in parallel) afterwards.
 
-            if res in self._cache:
-                t = self._cache[res]
-                t._should_update = True
-            else:
-                t = Thread.from_json(self,
-                                     thj,
-                                     last_modified=r.headers["last-modified"])
-                self._cache[res] = t
+            :param hydrate: should each thread be updated, to pull all
+                            replies
+            :type hydrate: bool
+            :param workers: how many threads to update at once, if hydrating
+            :type workers: int
+            :return: a list of :class:`fourch.Thread` objects, in catalog
+                     order
+            :rtype: list
+        """
+        url = self.url("api_catalog", board=self.name)
+        json, last_modified = get_json(self.session, url, self._endpoints)
 
-            if update_each:
-                t.update()
-            threads.append(t)
+        threads = self._threads_from_catalog(json, last_modified)
+        if hydrate and threads:
+            pool = ThreadPool(max(1, min(workers, len(threads))))
+            try:
+                # Only the requests run in parallel; applying them touches the
+                # cache, search index and reply graph, so happens here.
+                fetched = pool.map(lambda t: t._fetch(), threads)
+            finally:
+                pool.close()
+                pool.join()
+            for t, f in zip(threads, fetched):
+                t._updated(f)
+        return threads
+
+    def media_manifest(self):
+        """ List every file on the board, from a single fetch of the catalog.
+            Threads which are cached have all their files listed; the rest
+            only have those of the op and the replies in the catalog.
+
+            Nothing is cached or fetched besides the catalog, so this is
+            a cheap way to plan downloads or check for files already had.
+
+            :return: ``(thread number, post number, file)`` for every post
+                     with a file, in catalog order
+            :rtype: list of tuple
+        """
+        return self._manifest(self.catalog())
 
+    def _manifest(self, catalog):
+        """ List every file on the board, given the catalog's json.
+            See :meth:`media_manifest`.
+        """
+        manifest = []
+        for page in catalog:
+            for op in page["threads"]:
+                res = op["no"]
+                t = self._cache.get(res)
+                if t is not None:
+                    manifest.extend((res, r.number, r.file)
+                                    for r in [t.op] + t.replies
+                                    if r.has_file)
+                    continue
+                for post in [op] + op.get("last_replies", []):
+                    if "filename" in post:
+                        manifest.append((res, post["no"],
+                                         FileInfo.from_json(post, self)))
+        return manifest
+
+    def _threads_from_catalog(self, json, last_modified):
+        """ Turn the catalog's json into thread objects, or get the cached
+            ones.
+
+            :param json: the catalog json
+            :type json: list
+            :param last_modified: the catalog's Last-Modified header
+            :type last_modified: str
+            :return: a list of :class:`fourch.Thread` objects
+            :rtype: list
+        """
+        threads = []
+        for page in json:
+            for thj in page["threads"]:
+                # The catalog tucks the last replies into the op, and the
+                # catalog json is shared, so split them into a copy.
+                op = dict(thj)
+                replies = op.pop("last_replies", [])
+                threads.append(self._thread_from_page(
+                    {"posts": [op] + replies},
+                    last_modified
+                ))
         return threads
 
+    def _threads_from_page(self, json, last_modified):
+        """ Turn the json of a board page into thread objects, preferring
+            cached threads over making new ones.
+
+            :param json: the page json from the 4chan API
+            :type json: dict
+            :param last_modified: the page's Last-Modified header
+            :type last_modified: str
+            :return: a list of :class:`fourch.Thread` objects
+            :rtype: list
+        """
+        return [self._thread_from_page(thj, last_modified)
+                for thj in json["threads"]]
+
+    def _thread_from_page(self, thj, last_modified):
+        """ Turn the json of a single thread on a board page into a thread
+            object, or get the cached one.
+
+            :param thj: the thread's json, as in a page's ``threads`` list
+            :type thj: dict
+            :param last_modified: the page's Last-Modified header
+            :type last_modified: str
+            :return: the :class:`fourch.Thread` object
+            :rtype: :class:`fourch.Thread`
+        """
+        res = thj["posts"][0]["no"]
+
+        t = self._cache.get(res)
+        if t is not None:
+            t._should_update = True
+        else:
+            t = self._thread_class.from_json(self,
+                                             thj,
+                                             last_modified=last_modified)
+            self._cache[res] = t
+            t._index()
+        return t
+
     def thread_exists(self, res):
         """ Figure out whether or not a thread exists.
             This is as easy as checking if it 404s.
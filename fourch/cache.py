@@ -0,0 +1,186 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import time
+from collections import OrderedDict
+
+
+class ThreadCache(object):
+    """ A bounded, dict-like cache of :class:`fourch.Thread` objects keyed by
+        thread number, used as :attr:`fourch.Board._cache`.
+
+        Entries are kept in least recently used order, and the oldest are
+        evicted once there are more than ``max_entries`` threads, or once the
+        estimated size of all cached threads goes over ``max_bytes``. Entries
+        which haven't been stored or refreshed in ``ttl`` seconds are dropped
+        as well. Any of the limits can be left as None to disable it.
+
+        Anything with the same mapping interface (``get``, ``pop``,
+        ``__contains__``, ``__setitem__`` etc.) can be given to a board in its
+        place; a plain dict gives the old unbounded behaviour.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None,
+                 bytes_per_reply=1024, on_evict=None):
+        """ :param max_entries: the most threads to hold at once
+            :type max_entries: int or None
+            :param max_bytes: the most (estimated) bytes to hold at once
+            :type max_bytes: int or None
+            :param ttl: seconds after which an entry goes stale
+            :type ttl: int, float or None
+            :param bytes_per_reply: how many bytes to estimate each reply
+                                    (and the op) takes up
+            :type bytes_per_reply: int
+            :param on_evict: called as ``on_evict(res, thread)`` whenever a
+                             thread is evicted or expires; a board sets this
+                             to drop the thread from its search index
+            :type on_evict: callable or None
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes_per_reply = bytes_per_reply
+        self.on_evict = on_evict
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+        # {res: [thread, estimated bytes, time stored]}, oldest first.
+        self._entries = OrderedDict()
+
+    def __repr__(self):
+        return "<{0} {1} threads, ~{2} bytes>".format(
+            self.__class__.__name__,
+            len(self._entries),
+            self.bytes
+        )
+
+    def estimate(self, thread):
+        """ Estimate how much memory a thread takes up, from its reply count.
+
+            :param thread: the thread to size up
+            :type thread: :class:`fourch.Thread`
+            :return: the estimated size in bytes
+            :rtype: int
+        """
+        return (len(thread.replies) + 1) * self.bytes_per_reply
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[2] > self.ttl
+
+    def _remove(self, res):
+        entry = self._entries.pop(res)
+        self.bytes -= entry[1]
+        return entry[0]
+
+    def _evicted(self, res):
+        thread = self._remove(res)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(res, thread)
+
+    def _lookup(self, res):
+        entry = self._entries.get(res)
+        if entry is not None and self._expired(entry):
+            self._evicted(res)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # Move to the back, since it's now the most recently used.
+        self._entries[res] = self._entries.pop(res)
+        return entry[0]
+
+    def _evict(self):
+        if (self.max_entries is None and self.max_bytes is None
+                and self.ttl is None):
+            return
+        while self._entries:
+            # Not items(), which is a list of every entry on Python 2.
+            res = next(iter(self._entries))
+            entry = self._entries[res]
+            over = ((self.max_entries is not None
+                     and len(self._entries) > self.max_entries)
+                    or (self.max_bytes is not None
+                        and self.bytes > self.max_bytes))
+            if not over and not self._expired(entry):
+                break
+            self._evicted(res)
+
+    def get(self, res, default=None):
+        t = self._lookup(res)
+        return default if t is None else t
+
+    def pop(self, res, *default):
+        if res in self._entries:
+            return self._remove(res)
+        if default:
+            return default[0]
+        raise KeyError(res)
+
+    def expire(self):
+        """ Drop every entry which has outlived the ttl.
+        """
+        if self.ttl is None:
+            return
+        for res, entry in list(self._entries.items()):
+            if self._expired(entry):
+                self._evicted(res)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """ Get the cache's counters.
+
+            :return: the number of entries, estimated bytes, hits, misses and
+                     evictions
+            :rtype: dict
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __getitem__(self, res):
+        t = self._lookup(res)
+        if t is None:
+            raise KeyError(res)
+        return t
+
+    def __setitem__(self, res, thread):
+        if res in self._entries:
+            self._remove(res)
+        size = self.estimate(thread)
+        self._entries[res] = [thread, size, time.time()]
+        self.bytes += size
+        self._evict()
+
+    def __delitem__(self, res):
+        if res not in self._entries:
+            raise KeyError(res)
+        self._remove(res)
+
+    def __contains__(self, res):
+        entry = self._entries.get(res)
+        return entry is not None and not self._expired(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def keys(self):
+        return list(self._entries)
+
+    def values(self):
+        return [entry[0] for entry in self._entries.values()]
+
+    def items(self):
+        return [(res, entry[0]) for res, entry in self._entries.items()]
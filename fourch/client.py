@@ -0,0 +1,206 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import threading
+import time
+
+import requests
+import requests.adapters
+
+from ._version import __version__
+from .fourch import loads
+from .metrics import Metrics
+
+
+class _Call(object):
+    """ A GET in flight, which other callers asking for the same thing can
+        wait on rather than sending their own.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class Client(object):
+    """ A pooled HTTP client shared by every :class:`fourch.Board`, so
+        connections are reused across boards.
+
+        Identical GETs which are in flight at the same time are coalesced:
+        only the first is sent, and everyone asking gets its response.
+        Anything it doesn't wrap itself is passed through to the underlying
+        :class:`requests.Session`.
+
+        Every GET and HEAD it sends is recorded in ``metrics``.
+    """
+
+    def __init__(self, pool_size=20, metrics=None):
+        """ :param pool_size: how many connections to keep open per host
+            :type pool_size: int
+            :param metrics: where to record requests, a new one if not given
+            :type metrics: :class:`fourch.Metrics` or None
+        """
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.session = requests.Session()
+        self.session.headers.update({
+            "User-Agent": "fourch/{0} (@https://github.com/sysr-q/4ch)".format(
+                __version__
+            ),
+            "Accept-Encoding": "gzip, deflate",
+        })
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._inflight = {}  # {(url, headers): _Call}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1} in flight>".format(
+            self.__class__.__name__,
+            len(self._inflight)
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url, headers=None, **kwargs):
+        """ Send a GET, sharing the response with any identical GET that's
+            already in flight. Streamed requests (or any with extra options)
+            aren't coalesced, since their bodies can only be read once.
+
+            :param url: the url to fetch
+            :type url: str
+            :param headers: any extra headers to send
+            :type headers: dict or None
+            :return: the response
+            :rtype: requests.Response
+        """
+        if kwargs:
+            return self._request("GET", url, headers, **kwargs)
+
+        key = (url, tuple(sorted((headers or {}).items())))
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self.metrics.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self._request("GET", url, headers)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.done.set()
+        return call.response
+
+    def head(self, url, headers=None, **kwargs):
+        """ Send a HEAD. Unlike a GET, it isn't coalesced.
+
+            :param url: the url to check
+            :type url: str
+            :param headers: any extra headers to send
+            :type headers: dict or None
+            :return: the response
+            :rtype: requests.Response
+        """
+        kwargs.setdefault("allow_redirects", False)
+        return self._request("HEAD", url, headers, **kwargs)
+
+    def _request(self, method, url, headers, **kwargs):
+        start = time.time()
+        r = self.session.request(method, url, headers=headers, **kwargs)
+        took = time.time() - start
+        # The bytes sent over the wire, if the server says; streamed bodies
+        # haven't been read yet.
+        size = r.headers.get("content-length")
+        if method == "HEAD":
+            size = 0
+        elif size is not None:
+            size = int(size)
+        elif kwargs.get("stream"):
+            size = 0
+        else:
+            size = len(r.content)
+        self.metrics.request(url, r.status_code, took, size)
+        return r
+
+
+def decode(session, response):
+    """ Decode a json response, recording how long it took in the
+        session's metrics, if it has any.
+
+        :param session: what the request was sent through
+        :type session: :class:`Client` or requests.Session
+        :param response: the response to decode
+        :type response: requests.Response
+        :return: the decoded json
+    """
+    metrics = getattr(session, "metrics", None)
+    if metrics is None:
+        return loads(response.content)
+    start = time.time()
+    json = loads(response.content)
+    metrics.decode(response.url, time.time() - start)
+    return json
+
+
+def get_json(session, url, cache):
+    """ GET and decode a json endpoint, revalidating what's already in
+        ``cache`` with If-Modified-Since. On a 304 the cached json is handed
+        back as-is, without downloading or decoding anything.
+
+        :param session: what to send the request through
+        :type session: :class:`Client` or requests.Session
+        :param url: the url to fetch
+        :type url: str
+        :param cache: ``{url: (last_modified, json)}``, updated in place
+        :type cache: dict
+        :return: the decoded json, and its Last-Modified header
+        :rtype: tuple
+    """
+    cached = cache.get(url)
+    headers = None
+    if cached is not None:
+        headers = {"If-Modified-Since": cached[0]}
+
+    r = session.get(url, headers=headers)
+    if cached is not None and r.status_code == requests.codes.not_modified:
+        return cached[1], cached[0]
+    if r.status_code != requests.codes.ok:
+        r.raise_for_status()
+
+    json = decode(session, r)
+    last_modified = r.headers.get("last-modified")
+    if last_modified:
+        cache[url] = (last_modified, json)
+    else:
+        cache.pop(url, None)
+    return json, last_modified
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """ Get the process-wide :class:`Client`, making it if needs be.
+
+        :rtype: :class:`Client`
+    """
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Client()
+    return _default
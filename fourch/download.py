@@ -0,0 +1,347 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import errno
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+import requests
+
+
+class ChecksumError(IOError):
+    """ A downloaded file didn't match the MD5 it was supposed to have.
+    """
+
+
+class Download(object):
+    """ A single file to be fetched by a :class:`fourch.Downloader`.
+    """
+
+    def __init__(self, url, path, md5=None, size=0):
+        """ :param url: where to fetch the file from
+            :type url: str
+            :param path: where the file should be written to
+            :type path: str
+            :param md5: the file's (raw) MD5, if known
+            :type md5: bytes or None
+            :param size: the file's size in bytes, if known
+            :type size: int
+        """
+        self.url = url
+        self.path = path
+        self.md5 = md5
+        self.size = size
+
+    def __repr__(self):
+        return "<{0} {1} -> {2}>".format(
+            self.__class__.__name__,
+            self.url,
+            self.path
+        )
+
+
+def _alive(pid):
+    """ Is the process with the given pid still running? """
+    if os.name == "nt":
+        # os.kill() would terminate it, so leave it to the timeout.
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class Downloader(object):
+    """ Fetches a batch of files concurrently, using a fixed number of worker
+        threads which all share the keep-alive connection pool of a single
+        session (e.g. :attr:`fourch.Board.session`).
+    """
+
+    chunk_size = 64 * 1024
+    # Seconds between checks on a file another process is fetching.
+    claim_poll = 0.1
+    # Seconds to wait on another process's fetch before taking it over.
+    claim_timeout = 600
+
+    def __init__(self, session, concurrency=4, progress=None, store=None,
+                 limiter=None, per_host=None, claims=None):
+        """ :param session: the session to send requests through
+            :type session: requests.Session
+            :param concurrency: how many files to fetch at once
+            :type concurrency: int
+            :param progress: called as ``progress(done, total, download)``
+                             every time a file has been handled, from
+                             whichever worker handled it
+            :type progress: callable or None
+            :param store: a store to check for files by MD5 before fetching
+                          them, and to add fetched files to
+            :type store: :class:`fourch.ArchiveStore` or None
+            :param limiter: a limiter to take every byte downloaded from,
+                            capping the bandwidth used; share one between
+                            downloaders for a global cap
+            :type limiter: :class:`fourch.RateLimiter` or None
+            :param per_host: the most files to fetch from any one host at
+                             once
+            :type per_host: int or None
+            :param claims: the files being fetched, by MD5, shared with
+                           downloaders in other processes (e.g. a
+                           ``multiprocessing.Manager().dict()``), so only one
+                           process fetches any given file into the store
+            :type claims: dict-like or None
+        """
+        self.session = session
+        self.concurrency = max(1, int(concurrency))
+        self.progress = progress
+        self.store = store
+        self.limiter = limiter
+        self.per_host = per_host
+        self.claims = claims
+        self.done = 0
+        self.total = 0
+        self.linked = 0  # How many were already in the store.
+        self.failed = []  # [(fourch.Download, exception), ...]
+        self._lock = threading.Lock()
+        self._pending = {}  # {(md5, extension): threading.Event}
+        self._hosts = {}  # {host: threading.BoundedSemaphore}
+        self._size_pool()
+
+    def _size_pool(self):
+        # requests keeps 10 connections per host by default; any more workers
+        # than that would just be opening and throwing away connections.
+        for prefix in ("http://", "https://"):
+            adapter = self.session.get_adapter(prefix)
+            if getattr(adapter, "_pool_maxsize", 0) >= self.concurrency:
+                continue
+            self.session.mount(prefix, requests.adapters.HTTPAdapter(
+                pool_connections=self.concurrency,
+                pool_maxsize=self.concurrency
+            ))
+
+    def fetch(self, download):
+        """ Fetch a single file, streaming it to disk. If there's a store and
+            it already has a file with the same MD5, that's linked in instead.
+
+            Interrupted downloads are left as ``<path>.part`` and resumed the
+            next time around; if the file's MD5 is known, it's verified
+            before the file is put in place.
+
+            :param download: the file to fetch
+            :type download: :class:`fourch.Download`
+            :return: whether or not anything was downloaded
+            :rtype: bool
+        """
+        if os.path.exists(download.path):
+            return False
+
+        folder = os.path.dirname(download.path)
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        if self.store is None or download.md5 is None:
+            self._get(download)
+            return True
+
+        md5 = download.md5
+        ext = os.path.splitext(download.path)[1]
+        key = (md5, ext)
+
+        # Only one worker fetches any given file; the rest wait for it.
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = threading.Event()
+
+        if leader:
+            try:
+                if not self.store.has(md5, ext) and self._claim(key):
+                    try:
+                        self._get(download)
+                        self.store.add(md5, download.path, ext)
+                    finally:
+                        if self.claims is not None:
+                            self.claims.pop(key, None)
+                    return True
+            finally:
+                with self._lock:
+                    del self._pending[key]
+                pending.set()
+        else:
+            pending.wait()
+
+        if not self.store.has(md5, ext):
+            # Whoever was fetching it failed, so have a go ourselves.
+            self._get(download)
+            self.store.add(md5, download.path, ext)
+            return True
+
+        self.store.link(md5, download.path, ext)
+        with self._lock:
+            self.linked += 1
+        return False
+
+    def _claim(self, key):
+        """ Claim a file for this process to fetch. If another process has
+            already claimed it, wait until it's done with it, or take the
+            claim over if that process has died or taken longer than
+            ``claim_timeout``.
+
+            :return: whether or not this process should fetch the file
+            :rtype: bool
+        """
+        if self.claims is None:
+            return True
+        token = os.getpid()
+        if self.claims.setdefault(key, token) == token:
+            if self.store.has(*key):
+                # Someone else fetched it and let go of the claim since we
+                # last looked.
+                self.claims.pop(key, None)
+                return False
+            return True
+        deadline = time.time() + self.claim_timeout
+        while not self.store.has(*key):
+            owner = self.claims.get(key)
+            if owner is None:
+                return False
+            if not _alive(owner) or time.time() > deadline:
+                self.claims[key] = token
+                return True
+            time.sleep(self.claim_poll)
+        return False
+
+    def _get(self, download):
+        """ Stream a file to ``<path>.part``, resuming whatever is already
+            there with a Range request, and checking it against the expected
+            MD5 as it comes in. The file is only moved to its real path once
+            it's complete (and verified, if the MD5 is known).
+        """
+        part = download.path + ".part"
+        digest = self._stream(download, part, resume=True)
+        if download.md5 is not None and digest != download.md5:
+            # Maybe what we resumed from was bad; try once more from scratch.
+            digest = self._stream(download, part, resume=False)
+        if download.md5 is not None and digest != download.md5:
+            os.remove(part)
+            raise ChecksumError("MD5 mismatch for {0}".format(download.url))
+        os.rename(part, download.path)
+
+    def _stream(self, download, part, resume=True):
+        md5 = hashlib.md5()
+        offset = 0
+        if resume and os.path.exists(part):
+            with open(part, "rb") as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                    md5.update(chunk)
+                    offset += len(chunk)
+
+        # No transparent decompression, or byte ranges won't line up.
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = "bytes={0}-".format(offset)
+
+        host = self._host(download.url)
+        if host is not None:
+            host.acquire()
+        r = self.session.get(download.url, headers=headers, stream=True)
+        try:
+            if offset and r.status_code == 416:
+                # Range Not Satisfiable: we already have all of it.
+                return md5.digest()
+            r.raise_for_status()
+
+            mode = "ab"
+            if r.status_code != 206:
+                # The server sent the whole thing; start over.
+                md5 = hashlib.md5()
+                mode = "wb"
+
+            with open(part, mode) as f:
+                for chunk in r.iter_content(self.chunk_size):
+                    if self.limiter is not None:
+                        self.limiter.acquire(len(chunk))
+                    f.write(chunk)
+                    md5.update(chunk)
+        finally:
+            r.close()
+            if host is not None:
+                host.release()
+        return md5.digest()
+
+    def _host(self, url):
+        """ Get the semaphore limiting fetches from the url's host, if
+            there's a per-host limit.
+        """
+        if self.per_host is None:
+            return None
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def _finish(self, download):
+        with self._lock:
+            self.done += 1
+            if self.progress is not None:
+                self.progress(self.done, self.total, download)
+
+    def _worker(self, q):
+        while True:
+            try:
+                download = q.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.fetch(download)
+            except (requests.RequestException, IOError, OSError) as e:
+                with self._lock:
+                    self.failed.append((download, e))
+            self._finish(download)
+
+    def download(self, downloads):
+        """ Fetch all of the given files, blocking until they're all done.
+            Files which already exist are skipped, and files which fail are
+            recorded in :attr:`failed` rather than stopping the batch.
+
+            :param downloads: the files to fetch
+            :type downloads: iterable of :class:`fourch.Download`
+            :return: the number of files handled
+            :rtype: int
+        """
+        q = queue.Queue()
+        for d in downloads:
+            q.put(d)
+
+        count = q.qsize()
+        with self._lock:
+            self.total += count
+
+        workers = []
+        for _ in range(min(self.concurrency, count)):
+            w = threading.Thread(target=self._worker, args=(q,))
+            w.daemon = True
+            w.start()
+            workers.append(w)
+
+        # join() with a timeout so ^C still gets through to the main thread.
+        while workers:
+            workers[0].join(0.1)
+            workers = [w for w in workers if w.is_alive()]
+
+        return count
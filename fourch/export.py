@@ -0,0 +1,210 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import csv
+import io
+import json
+import os
+import sys
+
+PY2 = sys.version_info[0] < 3
+
+# What goes in a CSV export if no fields are given.
+DEFAULT_FIELDS = ("board", "thread", "no", "time", "name", "trip", "sub",
+                  "text", "filename", "ext", "fsize", "md5", "tim")
+
+
+class Exporter(object):
+    """ Streams posts out to an append-only file, one post per line, as
+        newline-delimited JSON or CSV.
+
+        Posts are written (and flushed) as they're given, so nothing but the
+        post being written is held in memory, however much is exported. Each
+        thread's posts are only ever written once: call :meth:`write_thread`
+        after every :meth:`fourch.Thread.update`, and just the new posts are
+        appended. That holds across runs too: when an existing file is
+        opened, it's read through once to find the last post written from
+        each thread. For that, the 'no' field has to be exported, and files
+        holding more than one thread need 'board' and 'thread' as well.
+
+        Fields are the keys of a post's json from the API, e.g. 'no', 'com'
+        or 'md5', plus 'board' and 'thread' (the thread's number), and
+        'text', the comment as plain text.
+    """
+
+    formats = ("ndjson", "csv")
+
+    def __init__(self, path, format="ndjson", fields=None):
+        """ :param path: the file to append to
+            :type path: str
+            :param format: 'ndjson' or 'csv'
+            :type format: str
+            :param fields: which fields to write, in order; for NDJSON, every
+                           field in the post's json (plus 'board' and
+                           'thread') if not given
+            :type fields: list or None
+        """
+        if format not in self.formats:
+            raise ValueError("Unknown export format: {0!r}".format(format))
+        if format == "csv" and fields is None:
+            fields = DEFAULT_FIELDS
+
+        self.path = path
+        self.format = format
+        self.fields = list(fields) if fields is not None else None
+        self._last = {}  # {(board, thread): last post number written}
+        # The same, read from what was already in the file, with None for
+        # whichever of board and thread it doesn't have.
+        self._resumed = {}
+        if os.path.exists(path) and os.path.getsize(path):
+            self._resume()
+
+        if PY2:
+            self._file = open(path, "ab")
+        else:
+            self._file = io.open(path, "a", encoding="utf-8", newline="")
+        if format == "csv":
+            self._csv = csv.writer(self._file)
+            if self._file.tell() == 0:
+                self._writerow(self.fields)
+
+    def __repr__(self):
+        return "<{0} {1} {2}>".format(
+            self.__class__.__name__,
+            self.format,
+            self.path
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _has(self, field):
+        return self.fields is None or field in self.fields
+
+    def _resume(self):
+        """ Find the last post written from each thread in the file.
+        """
+        if not self._has("no"):
+            raise ValueError("Can't append to {0} without exporting the "
+                             "'no' field".format(self.path))
+        if PY2:
+            f = open(self.path, "rb")
+        else:
+            f = io.open(self.path, encoding="utf-8", newline="")
+        with f:
+            if self.format == "csv":
+                reader = csv.reader(f)
+                header = next(reader, [])
+                rows = (dict(zip(header, row)) for row in reader)
+            else:
+                rows = (self._loads(line) for line in f)
+            for row in rows:
+                try:
+                    no = int(row["no"])
+                    thread = row.get("thread")
+                    key = (row.get("board") or None,
+                           int(thread) if thread else None)
+                except (KeyError, TypeError, ValueError):
+                    # Not a post, or cut off partway through.
+                    continue
+                if no > self._resumed.get(key, 0):
+                    self._resumed[key] = no
+
+    @staticmethod
+    def _loads(line):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return {}
+
+    def project(self, reply):
+        """ Pick out the exported fields of a post.
+
+            :param reply: the post to export
+            :type reply: :class:`fourch.Reply`
+            :return: ``{field: value}``, with None for missing fields
+            :rtype: dict
+        """
+        if self.fields is None:
+            row = dict(reply._json)
+            row["board"] = reply._thread._board.name
+            row["thread"] = int(reply._thread.res)
+            return row
+        return dict((field, self._field(reply, field))
+                    for field in self.fields)
+
+    @staticmethod
+    def _field(reply, field):
+        if field == "board":
+            return reply._thread._board.name
+        if field == "thread":
+            return int(reply._thread.res)
+        if field == "text":
+            return reply.comment_text
+        return reply._json.get(field)
+
+    def write(self, replies):
+        """ Append posts to the file.
+
+            :param replies: the posts to write
+            :type replies: iterable of :class:`fourch.Reply`
+            :return: how many posts were written
+            :rtype: int
+        """
+        written = 0
+        for r in replies:
+            if self.format == "ndjson":
+                self._file.write(
+                    json.dumps(self.project(r), sort_keys=True) + "\n")
+            else:
+                row = self.project(r)
+                self._writerow([row[field] for field in self.fields])
+            written += 1
+        self._file.flush()
+        return written
+
+    def write_thread(self, thread):
+        """ Append the posts of a thread which haven't been written yet,
+            i.e. those newer than the last one written from it.
+
+            :param thread: the thread to export
+            :type thread: :class:`fourch.Thread`
+            :return: how many posts were written
+            :rtype: int
+        """
+        key = (thread._board.name, int(thread.res))
+        last = self._last.get(key)
+        if last is None:
+            last = self._resumed.get((key[0] if self._has("board") else None,
+                                      key[1] if self._has("thread") else None),
+                                     0)
+        posts = [r for r in [thread.op] + thread.replies if r.number > last]
+        if posts:
+            self._last[key] = posts[-1].number
+        return self.write(posts)
+
+    def write_board(self, board):
+        """ Export every live thread on a board, fetching each in turn.
+
+            :param board: the board to export
+            :type board: :class:`fourch.Board`
+            :return: how many posts were written
+            :rtype: int
+        """
+        written = 0
+        for page in board.threads():
+            for th in page["threads"]:
+                t = board.thread(th["no"])
+                if t is not None and t.alive:
+                    written += self.write_thread(t)
+        return written
+
+    def _writerow(self, row):
+        if PY2:
+            row = [v.encode("utf-8") if isinstance(v, unicode) else v
+                   for v in row]
+        self._csv.writerow(["" if v is None else v for v in row])
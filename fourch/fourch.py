@@ -1,4 +1,9 @@
 # vim: sw=4 expandtab softtabstop=4 autoindent
+import codecs
+import importlib
+import json
+import re
+
 from ._version import __version__
 
 urls = {
@@ -19,3 +24,125 @@ urls = {
 class struct:
     def __init__(self, **entries):
         self.__dict__.update(entries)
+
+
+def _best_decoder():
+    # Prefer whichever faster json library is installed.
+    for name in ("orjson", "ujson", "simplejson"):
+        try:
+            return importlib.import_module(name).loads
+        except ImportError:
+            continue
+    return json.loads
+
+
+_decoder = _best_decoder()
+
+
+def loads(s):
+    """ Decode a json document with the current decoder.
+        See :func:`set_decoder`.
+
+        :param s: the json document
+        :type s: str or bytes
+    """
+    return _decoder(s)
+
+
+def set_decoder(decoder=None):
+    """ Change the function used to decode every API response.
+
+        By default this is the ``loads`` of orjson, ujson or simplejson,
+        whichever is installed first, and :func:`json.loads` otherwise.
+
+        :param decoder: takes the response body and returns the decoded json,
+                        or None to go back to the default
+        :type decoder: callable or None
+    """
+    global _decoder
+    _decoder = decoder if decoder is not None else _best_decoder()
+
+
+_threads_re = re.compile(r'"threads"\s*:\s*\[')
+_skip_re = re.compile(r"[\s,]*")
+# The start of a "threads" key which hasn't finished arriving.
+_threads_tail_re = re.compile(r'"threads"\s*(?::\s*)?\Z')
+
+
+def iter_threads(chunks):
+    """ Incrementally parse a catalog or board page, yielding the json of
+        each thread in its ``threads`` list(s) as soon as it has been read,
+        rather than decoding the whole document first.
+
+        :param chunks: the response body, in pieces
+        :type chunks: iterable of bytes
+        :return: a generator yielding each thread's json
+        :rtype: generator
+    """
+    parser = thread_parser()
+    for chunk in chunks:
+        for thread in parser.send(chunk):
+            yield thread
+
+
+def thread_parser():
+    """ The parser behind :func:`iter_threads`, for when the chunks are
+        pushed in rather than pulled (e.g. from an async response): send it
+        each chunk, and it gives back the threads finished by that chunk.
+
+            parser = thread_parser()
+            for chunk in body:
+                for thread in parser.send(chunk):
+                    ...
+
+        :return: a primed generator, taking bytes and giving lists of json
+        :rtype: generator
+    """
+    parser = _thread_parser()
+    next(parser)
+    return parser
+
+
+def _thread_parser():
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = u""
+    pos = 0
+    inside = False  # Are we inside of a "threads" list?
+    threads = []
+
+    while True:
+        chunk = yield threads
+        threads = []
+        buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+
+        while True:
+            if not inside:
+                m = _threads_re.search(buf, pos)
+                if m is None:
+                    # Hang on to the end, the key might be split over chunks,
+                    # however much whitespace there is in it.
+                    tail = _threads_tail_re.search(buf, pos)
+                    if tail is not None:
+                        pos = tail.start()
+                    else:
+                        pos = max(pos, len(buf) - len('"threads"') + 1)
+                    break
+                pos = m.end()
+                inside = True
+
+            pos = _skip_re.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                inside = False
+                pos += 1
+                continue
+
+            try:
+                thread, pos = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Only part of the thread has arrived so far.
+                break
+            threads.append(thread)
@@ -0,0 +1,97 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import os
+
+from .download import Download
+
+
+class MediaPlanner(object):
+    """ Works out which of a thread's files to fetch, and in what order, for
+        a :class:`fourch.Downloader`.
+
+        Thumbnails can be fetched before any full files, so there's something
+        to look at quickly; files can be skipped by extension or size; and
+        big files (WebMs, by default) are pushed to the back of the queue,
+        smallest first, so they don't hold everything else up.
+    """
+
+    def __init__(self, thumbs=False, max_size=None, skip_extensions=(),
+                 defer_size=None, defer_extensions=(".webm",)):
+        """ :param thumbs: fetch thumbnails (into a ``thumbs`` folder) before
+                           any full files
+            :type thumbs: bool
+            :param max_size: skip files bigger than this many bytes
+            :type max_size: int or None
+            :param skip_extensions: skip files with these extensions,
+                                    e.g. ('.webm', '.gif')
+            :type skip_extensions: iterable
+            :param defer_size: fetch files bigger than this many bytes last
+            :type defer_size: int or None
+            :param defer_extensions: fetch files with these extensions last
+            :type defer_extensions: iterable
+        """
+        self.thumbs = thumbs
+        self.max_size = max_size
+        self.skip_extensions = set(e.lower() for e in skip_extensions)
+        self.defer_size = defer_size
+        self.defer_extensions = set(e.lower() for e in defer_extensions)
+
+    def __repr__(self):
+        return "<{0}>".format(self.__class__.__name__)
+
+    def skip(self, f):
+        """ Should the given file be skipped?
+
+            :param f: a post's file, as in :attr:`fourch.Reply.file`
+            :rtype: bool
+        """
+        if f.extension.lower() in self.skip_extensions:
+            return True
+        return self.max_size is not None and f.size > self.max_size
+
+    def defer(self, f):
+        """ Should the given file be fetched after everything else?
+
+            :param f: a post's file, as in :attr:`fourch.Reply.file`
+            :rtype: bool
+        """
+        if f.extension.lower() in self.defer_extensions:
+            return True
+        return self.defer_size is not None and f.size > self.defer_size
+
+    def plan(self, replies, folder):
+        """ Plan the downloads for the files of the given posts.
+
+            :param replies: the posts to fetch files from
+            :type replies: iterable of :class:`fourch.Reply`
+            :param folder: the folder to put files in
+            :type folder: str
+            :return: the downloads, in the order they should be fetched
+            :rtype: list of :class:`fourch.Download`
+        """
+        thumbs = []
+        files = []
+        for r in replies:
+            if not r.has_file:
+                continue
+            f = r.file
+            if f.deleted:
+                continue
+
+            if self.thumbs:
+                thumbs.append(Download(
+                    f.thumb_url,
+                    os.path.join(folder, "thumbs", f.thumb_url.split("/")[-1])
+                ))
+            if self.skip(f):
+                continue
+            deferred = self.defer(f)
+            files.append(((deferred, f.size if deferred else 0),
+                          Download(f.url,
+                                   os.path.join(folder, f.url.split("/")[-1]),
+                                   md5=f.md5,
+                                   size=f.size)))
+
+        # Post order otherwise, but anything deferred goes last, smallest
+        # first. (sort is stable.)
+        files.sort(key=lambda i: i[0])
+        return thumbs + [d for _, d in files]
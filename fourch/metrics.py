@@ -0,0 +1,161 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import re
+import threading
+
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+
+# What kind of request a url is, by its path; anything else is a file.
+_endpoints = [
+    ("boards", re.compile(r"^/boards\.json$")),
+    ("catalog", re.compile(r"^/\w+/catalog\.json$")),
+    ("threads", re.compile(r"^/\w+/threads\.json$")),
+    ("thread", re.compile(r"^/\w+/thread/\d+\.json$")),
+    ("page", re.compile(r"^/\w+/\d+\.json$")),
+]
+
+
+def endpoint(url):
+    """ Work out which API endpoint a url is for.
+
+        :param url: the url requested
+        :type url: str
+        :return: 'boards', 'catalog', 'threads', 'thread', 'page' or 'file'
+        :rtype: str
+    """
+    path = urlsplit(url).path
+    for name, pattern in _endpoints:
+        if pattern.match(path):
+            return name
+    return "file"
+
+
+class Metrics(object):
+    """ Counts what goes over the wire, per endpoint: requests and their
+        status codes (so you can see how often If-Modified-Since saves a
+        download), bytes, latency histograms and json decode time.
+
+        Every :class:`fourch.Client` has one, as ``client.metrics``. Read it
+        with :meth:`stats`, or pass a callback to see each event as it
+        happens. Requests sent by :mod:`fourch.aio` don't go through a
+        client, so aren't counted.
+    """
+
+    # Upper bounds of the latency histogram's buckets, in seconds; the last
+    # bucket is everything slower.
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, callback=None):
+        """ :param callback: called with a dict for every request and decode,
+                             e.g. ``{'event': 'request', 'endpoint': 'thread',
+                             'url': ..., 'status': 304, 'seconds': 0.05,
+                             'bytes': 0}`` or ``{'event': 'decode',
+                             'endpoint': 'thread', 'url': ..., 'seconds':
+                             0.001}``
+            :type callback: callable or None
+        """
+        self.callback = callback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        return "<{0} {1} requests>".format(
+            self.__class__.__name__,
+            sum(e["requests"] for e in self._endpoints.values())
+        )
+
+    def reset(self):
+        """ Zero every counter. """
+        with self._lock:
+            self._endpoints = {}
+            self.coalesced = 0
+
+    def _endpoint(self, name):
+        e = self._endpoints.get(name)
+        if e is None:
+            e = self._endpoints[name] = {
+                "requests": 0,
+                "status": {},
+                "bytes": 0,
+                "seconds": 0.0,
+                "max_seconds": 0.0,
+                "histogram": [0] * (len(self.buckets) + 1),
+                "decodes": 0,
+                "decode_seconds": 0.0,
+            }
+        return e
+
+    def request(self, url, status, seconds, size):
+        """ Record a request.
+
+            :param url: the url requested
+            :type url: str
+            :param status: the response's status code
+            :type status: int
+            :param seconds: how long it took
+            :type seconds: float
+            :param size: how many bytes of body came back
+            :type size: int
+        """
+        name = endpoint(url)
+        with self._lock:
+            e = self._endpoint(name)
+            e["requests"] += 1
+            e["status"][status] = e["status"].get(status, 0) + 1
+            e["bytes"] += size
+            e["seconds"] += seconds
+            e["max_seconds"] = max(e["max_seconds"], seconds)
+            i = 0
+            while i < len(self.buckets) and seconds > self.buckets[i]:
+                i += 1
+            e["histogram"][i] += 1
+        if self.callback is not None:
+            self.callback({"event": "request", "endpoint": name, "url": url,
+                           "status": status, "seconds": seconds,
+                           "bytes": size})
+
+    def decode(self, url, seconds):
+        """ Record decoding a json response.
+
+            :param url: the url the json came from
+            :type url: str
+            :param seconds: how long decoding took
+            :type seconds: float
+        """
+        name = endpoint(url)
+        with self._lock:
+            e = self._endpoint(name)
+            e["decodes"] += 1
+            e["decode_seconds"] += seconds
+        if self.callback is not None:
+            self.callback({"event": "decode", "endpoint": name, "url": url,
+                           "seconds": seconds})
+
+    def stats(self):
+        """ Get a snapshot of the counters.
+
+            :return: ``{'requests', 'bytes', 'coalesced', 'buckets',
+                     'endpoints'}``, where ``endpoints`` maps each endpoint
+                     to its ``requests``, ``status`` ({code: count}),
+                     ``bytes``, ``seconds``, ``max_seconds``, ``histogram``
+                     (counts per bucket in ``buckets``, then the overflow),
+                     ``decodes`` and ``decode_seconds``
+            :rtype: dict
+        """
+        with self._lock:
+            endpoints = {}
+            for name, e in self._endpoints.items():
+                e = dict(e)
+                e["status"] = dict(e["status"])
+                e["histogram"] = list(e["histogram"])
+                endpoints[name] = e
+            coalesced = self.coalesced
+        return {
+            "requests": sum(e["requests"] for e in endpoints.values()),
+            "bytes": sum(e["bytes"] for e in endpoints.values()),
+            "coalesced": coalesced,
+            "buckets": list(self.buckets),
+            "endpoints": endpoints,
+        }
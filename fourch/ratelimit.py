@@ -0,0 +1,93 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import multiprocessing
+import threading
+import time
+
+
+class RateLimiter(object):
+    """ A thread-safe token bucket, used to keep anything that shares it
+        (requests, bytes downloaded, ...) under a given rate.
+
+        Callers can take more than is in the bucket; they're then made to
+        wait until the bucket would have refilled, so large amounts are
+        paced out rather than refused.
+    """
+
+    def __init__(self, rate, burst=1):
+        """ :param rate: how many tokens to add to the bucket per second
+            :type rate: int or float
+            :param burst: how many tokens the bucket holds when full
+            :type burst: int or float
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<{0} {1}/s>".format(self.__class__.__name__, self.rate)
+
+    def reserve(self, amount=1):
+        """ Take tokens out of the bucket, without waiting.
+
+            :param amount: how many tokens to take
+            :type amount: int or float
+            :return: how many seconds the caller should wait before going
+                     ahead, to stay under the rate
+            :rtype: float
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, amount=1):
+        """ Take tokens out of the bucket, waiting until the rate allows it.
+
+            :param amount: how many tokens to take
+            :type amount: int or float
+        """
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """ A :class:`RateLimiter` whose bucket lives in shared memory, so it
+        can be handed to worker processes (when they're started, e.g. as
+        a pool's ``initargs``) and keep all of them under one rate.
+    """
+
+    def __init__(self, rate, burst=1):
+        """ :param rate: how many tokens to add to the bucket per second
+            :type rate: int or float
+            :param burst: how many tokens the bucket holds when full
+            :type burst: int or float
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        # [tokens, last refill], and the lock guarding them.
+        self._state = multiprocessing.Array("d", [float(burst), time.time()])
+        self._lock = self._state.get_lock()
+
+    @property
+    def _tokens(self):
+        return self._state[0]
+
+    @_tokens.setter
+    def _tokens(self, tokens):
+        self._state[0] = tokens
+
+    @property
+    def _last(self):
+        return self._state[1]
+
+    @_last.setter
+    def _last(self, last):
+        self._state[1] = last
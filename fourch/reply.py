@@ -1,15 +1,187 @@
 # vim: sw=4 expandtab softtabstop=4 autoindent
-import fourch
+from . import fourch
 import base64
 import re
 
+try:
+    from htmlentitydefs import name2codepoint
+except ImportError:
+    from html.entities import name2codepoint
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+# Everything comment_text cares about, matched in a single pass:
+# <span class="quote">&gt;text!</span> --- >text!
+# <a class="quotelink" href="XX#pYYYY">&gt;&gt;YYYY</a> --- >>YYYY
+# <br> or <br /> --- newline
+# &amp;, &#39; etc --- unescaped
+_comment_re = re.compile(r"<span[^>]+>(?:&gt;|>)([^</]+)</span>"
+                         r"|<a[^>]+>(?:&gt;|>){2}(\d+)</a>"
+                         r"|<br ?/?>"
+                         r"|&(#\d+|#x[0-9a-f]+|\w+);",
+                         flags=re.I)
+_entity_re = re.compile(r"&(#\d+|#x[0-9a-f]+|\w+);", flags=re.I)
+_quotelink_re = re.compile(r"<a[^>]+>(?:&gt;|>){2}(\d+)</a>", flags=re.I)
+
+
+def _unescape(entity, raw):
+    try:
+        if entity[:2] in ("#x", "#X"):
+            return unichr(int(entity[2:], 16))
+        elif entity[0] == "#":
+            return unichr(int(entity[1:]))
+        elif entity == "apos":
+            return u"'"
+        return unichr(name2codepoint[entity])
+    except (KeyError, ValueError, OverflowError):
+        # Not something we know how to unescape, leave it be.
+        return raw
+
+
+def _unescape_match(m):
+    return _unescape(m.group(1), m.group(0))
+
+
+def render_comment(com, op=None):
+    """ Turn a post's HTML comment into (mostly) plain text.
+
+        :param com: the comment, including escaped HTML
+        :type com: str
+        :param op: the thread op's post number, to mark quotes of it
+                   with "(OP)"
+        :type op: int or None
+        :return: the plain text comment
+        :rtype: unicode
+    """
+    def replace(m):
+        text, quote = m.group(1, 2)
+        if text is not None:
+            return u">" + _entity_re.sub(_unescape_match, text)
+        elif quote is not None:
+            if op is not None and int(quote) == op:
+                return u">>" + quote + u" (OP)"
+            return u">>" + quote
+        elif m.group(3) is not None:
+            return _unescape(m.group(3), m.group(0))
+        return u"\n"
+    return _comment_re.sub(replace, com)
+
+
+class FileInfo(object):
+    """ The file attached to a post: its name, size, MD5, dimensions and
+        urls. These are worked out once, and can't be changed afterwards.
+
+        Information stored:
+
+        - renamed
+        - name
+        - extension
+        - size
+        - md5
+        - md5b64
+        - width
+        - height
+        - thumb_width
+        - thumb_height
+        - deleted
+        - spoiler
+        - url
+        - thumb_url
+    """
+
+    __slots__ = ("renamed", "name", "extension", "size", "md5", "md5b64",
+                 "width", "height", "thumb_width", "thumb_height", "deleted",
+                 "spoiler", "url", "thumb_url")
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FileInfo is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FileInfo is immutable")
+
+    # Pickling and copying would restore the slots through __setattr__.
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+                    if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return "<{0} {1}>".format(
+            self.__class__.__name__,
+            getattr(self, "url", "(no file)")
+        )
+
+    @classmethod
+    def from_json(cls, json, board):
+        """ Make the file info for a post.
+
+            :param json: the post's json, from a thread, page or catalog
+            :type json: dict
+            :param board: the board the post is on
+            :type board: :class:`fourch.Board`
+            :return: the file info, with nothing set if there's no file
+            :rtype: :class:`fourch.FileInfo`
+        """
+        if "filename" not in json:
+            return _no_file
+        renamed = json.get("tim", 0)
+        extension = json.get("ext", "")
+        return cls(
+            renamed=renamed,
+            name=json.get("filename", ""),
+            extension=extension,
+            size=json.get("fsize", 0),
+            md5=base64.b64decode(json.get("md5")),
+            md5b64=json.get("md5", ""),
+            width=json.get("w", 0),
+            height=json.get("h", 0),
+            thumb_width=json.get("tn_w", 0),
+            thumb_height=json.get("tn_h", 0),
+            deleted=bool(json.get("filedeleted", 0)),
+            spoiler=bool(json.get("spoiler", 0)),
+            url="{0}{1}/{2}/{3}{4}".format(
+                board.proto,
+                fourch.urls["images"],
+                board.name,
+                renamed,
+                extension
+            ),
+            thumb_url="{0}{1}/{2}/{3}s.jpg".format(
+                board.proto,
+                fourch.urls["thumbs"],
+                board.name,
+                renamed
+            )
+        )
+
+
+# What posts without a file get; none of its fields are set.
+_no_file = FileInfo()
+
 
 class Reply(object):
     """ This object stores information regarding a specific post
         on any given thread. It uses python properties to easily
         allow access to information.
+
+        The fields used on every update (number, reply_to and timestamp) are
+        pulled out of the json into slots when the reply is made; everything
+        else is read out of the json on access.
     """
 
+    __slots__ = ("_thread", "_json", "_no", "_resto", "_time", "_text",
+                 "_quotes", "_file")
+
     def __init__(self, thread, json):
         """ Initialize the reply with the relevant information
 
@@ -19,7 +191,21 @@ class Reply(object):
             :type json: dict
         """
         self._thread = thread
+        self._load(json)
+
+    def _load(self, json):
+        """ (Re)load the reply from the given post json.
+
+            :param json: the json data for this post
+            :type json: dict
+        """
         self._json = json
+        self._no = json.get("no", 0)
+        self._resto = json.get("resto", 0)
+        self._time = json.get("time", 0)
+        self._text = None
+        self._quotes = None
+        self._file = None
 
     def __repr__(self):
         return "<{0}.{1} /{2}/{3}#{4}, image: {5}>".format(
@@ -34,17 +220,17 @@ class Reply(object):
     @property
     def is_op(self):
         """Is this post the OP (first post in thread)"""
-        return self._json.get("resto", 1) == 0
+        return self._resto == 0 and "resto" in self._json
 
     @property
     def number(self):
         """The number relating to this post"""
-        return self._json.get("no", 0)
+        return self._no
 
     @property
     def reply_to(self):
         """What post ID is this a reply to"""
-        return self._json.get("resto", 0)
+        return self._resto
 
     @property
     def sticky(self):
@@ -64,7 +250,7 @@ class Reply(object):
     @property
     def timestamp(self):
         """The UNIX timestamp of post time"""
-        return self._json.get("time", 0)
+        return self._time
 
     @property
     def tripcode(self):
@@ -111,36 +297,39 @@ class Reply(object):
     @property
     def comment_text(self):
         """ The stripped (mostly) plain text version of the comment.
-            The comment goes through various regexes to become (mostly) clean.
+            Quotes, quotelinks and line breaks are turned into text and
+            entities are unescaped; it's only worked out once per reply.
 
-            Some HTML will still be present, this is because Python's
-            :mod:`HTMLParser` won't escape everything, and since it's
-            undocumented, only god may know how to add more escapes.
+            Some HTML will still be present, as only the markup 4chan
+            commonly uses is converted.
         """
-        import HTMLParser
-        com = self.comment
-        # <span class="quote">&gt;text!</span>
-        # --- >text!
-        com = re.sub(r"\<span[^>]+\>(?:&gt;|>)([^</]+)\<\/span\>",
-                     r">\1",
-                     com,
-                     flags=re.I)
-        # <a class="quotelink" href="XX#pYYYY">&gt;&gt;YYYY</a>
-        # --- >>YYYY
-        com = re.sub(r"\<a[^>]+\>(?:&gt;|>){2}(\d+)\<\/a\>",
-                     r">>\1",
-                     com,
-                     flags=re.I)
-        # Add (OP) to quotelinks to op
-        com = re.sub(r"\>\>({0})".format(self._thread.op.number),
-                     r">>\1 (OP)",
-                     com,
-                     flags=re.I)
-        # <br> or <br /> to newline
-        com = re.sub(r"\<br ?\/?\>", "\n", com, flags=re.I)
-        # Send the remaining HTML through the HTMLParser to unescape.
-        com = HTMLParser.HTMLParser().unescape(com)
-        return com
+        if self._text is None:
+            self._text = render_comment(self.comment, self._thread.op.number)
+        return self._text
+
+    @property
+    def quotes(self):
+        """ The numbers of the posts this one quotelinks to, in the order
+            they're quoted. These may be in other threads, or deleted.
+        """
+        if self._quotes is None:
+            seen = set()
+            self._quotes = []
+            for no in _quotelink_re.findall(self.comment):
+                no = int(no)
+                if no not in seen:
+                    seen.add(no)
+                    self._quotes.append(no)
+        return self._quotes
+
+    @property
+    def quoted_by(self):
+        """ The replies in this thread which quotelink to this post,
+            in post order.
+        """
+        return [self._thread._posts[no]
+                for no in self._thread._backlinks.get(self._no, ())
+                if no in self._thread._posts]
 
     @property
     def url(self):
@@ -164,58 +353,12 @@ class Reply(object):
         """ This holds the information regarding the image attached
             to a post, if there is one at all.
 
-            It returns the relevant information in a class format,
-            accessible via ``r.file.url``, for example.
-
-            Information stored:
-
-            - renamed
-            - name
-            - extension
-            - size
-            - md5
-            - md5b64
-            - width
-            - height
-            - thumb_width
-            - thumb_height
-            - deleted
-            - spoiler
-            - url
-            - thumb_url
-
-            :return: a struct with information related to image
+            It's accessible as attributes, ``r.file.url`` for example, and
+            is only worked out the first time it's asked for.
+
+            :return: the post's file
+            :rtype: :class:`fourch.FileInfo`
         """
-        if not self.has_file:
-            return fourch.struct()
-        f = {
-            "renamed": self._json.get("tim", 0),
-            "name": self._json.get("filename", ""),
-            "extension": self._json.get("ext", ""),
-            "size": self._json.get("fsize", 0),
-            "md5": base64.b64decode(self._json.get("md5")),
-            "md5b64": self._json.get("md5", ""),
-            "width": self._json.get("w", 0),
-            "height": self._json.get("h", 0),
-            "thumb_width": self._json.get("tn_w", 0),
-            "thumb_height": self._json.get("tn_h", 0),
-            "deleted": bool(self._json.get("filedeleted", 0)),
-            "spoiler": bool(self._json.get("spoiler", 0)),
-
-            "url": "",
-            "thumb_url": ""
-        }
-        f["url"] = "{0}{1}/{2}/{3}{4}".format(
-            self._thread._board.proto,
-            fourch.urls["images"],
-            self._thread._board.name,
-            f["renamed"],
-            f["extension"]
-        )
-        f["thumb_url"] = "{0}{1}/{2}/{3}s.jpg".format(
-            self._thread._board.proto,
-            fourch.urls["thumbs"],
-            self._thread._board.name,
-            f["renamed"]
-        )
-        return fourch.struct(**f)
+        if self._file is None:
+            self._file = FileInfo.from_json(self._json, self._thread._board)
+        return self._file
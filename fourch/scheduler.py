@@ -0,0 +1,165 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import heapq
+import itertools
+import time
+
+import requests
+
+from .ratelimit import RateLimiter
+from .thread import ThreadDelta
+
+
+class Scheduler(object):
+    """ Keeps any number of :class:`fourch.Thread` objects, from any number
+        of boards, up to date from a single priority queue.
+
+        Each thread is polled again after an interval worked out from how
+        fast it's being posted in, and every update shares one request
+        budget, so the whole lot stays within the API's rate limit while the
+        busiest threads get the freshest polls. A poll which fails (the
+        connection drops, or the API errors) is tried again after
+        ``max_interval``, and counted in ``errors``.
+    """
+
+    def __init__(self, rate=1.0, min_interval=10, max_interval=600,
+                 window=10, limiter=None):
+        """ :param rate: the most updates to send per second
+            :type rate: int or float
+            :param min_interval: the least seconds between polls of a thread
+            :type min_interval: int or float
+            :param max_interval: the most seconds between polls of a thread
+            :type max_interval: int or float
+            :param window: how many of a thread's latest posts to work out
+                           its posting rate from
+            :type window: int
+            :param limiter: a limiter to share with something else, instead
+                            of making one from ``rate``
+            :type limiter: :class:`fourch.RateLimiter` or None
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.window = window
+        self.limiter = limiter if limiter is not None else RateLimiter(rate)
+
+        self._queue = []  # heap of [due, tiebreak, thread]
+        self._entries = {}  # {thread: entry in _queue}
+        self._counter = itertools.count()
+        self.errors = 0
+
+    def __repr__(self):
+        return "<{0} {1} threads>".format(
+            self.__class__.__name__,
+            len(self._entries)
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, thread):
+        return thread in self._entries
+
+    def interval(self, thread):
+        """ Work out how long to wait before polling a thread again.
+
+            This is the average time between its last few posts, or the time
+            since its last post if that's longer, kept between
+            ``min_interval`` and ``max_interval``.
+
+            :param thread: the thread to look at
+            :type thread: :class:`fourch.Thread`
+            :return: seconds until the next poll
+            :rtype: float
+        """
+        posts = thread.replies[-self.window:]
+        if len(posts) < self.window:
+            posts = [thread.op] + posts
+        if len(posts) < 2:
+            return float(self.max_interval)
+
+        last = posts[-1].timestamp
+        gap = (last - posts[0].timestamp) / float(len(posts) - 1)
+        gap = max(gap, time.time() - last)
+        return float(min(max(gap, self.min_interval), self.max_interval))
+
+    def add(self, thread, due=None):
+        """ Start polling a thread, or change when it's next polled.
+
+            :param thread: the thread to poll
+            :type thread: :class:`fourch.Thread`
+            :param due: when to next poll it, as a UNIX timestamp; right away
+                        if not given
+            :type due: int or float or None
+        """
+        self.remove(thread)
+        entry = [time.time() if due is None else due,
+                 next(self._counter),
+                 thread]
+        self._entries[thread] = entry
+        heapq.heappush(self._queue, entry)
+
+    def remove(self, thread):
+        """ Stop polling a thread.
+
+            :param thread: the thread to stop polling
+            :type thread: :class:`fourch.Thread`
+        """
+        entry = self._entries.pop(thread, None)
+        if entry is not None:
+            # Left in the heap, and skipped once it comes up.
+            entry[2] = None
+
+    def next_due(self):
+        """ When the next poll is due.
+
+            :return: a UNIX timestamp, or None if there's nothing to poll
+            :rtype: float or None
+        """
+        while self._queue and self._queue[0][2] is None:
+            heapq.heappop(self._queue)
+        if not self._queue:
+            return None
+        return self._queue[0][0]
+
+    def step(self):
+        """ Wait until the next poll is due and the rate limit allows it,
+            then update that thread and schedule its next poll. Threads which
+            404 are dropped, and those which fail to update are polled again
+            after ``max_interval``.
+
+            :return: the thread polled and what changed (nothing, if the
+                     update failed), or None if there's nothing to poll
+            :rtype: tuple or None
+        """
+        due = self.next_due()
+        if due is None:
+            return None
+        entry = heapq.heappop(self._queue)
+        thread = entry[2]
+        del self._entries[thread]
+
+        time.sleep(max(0, due - time.time()))
+        self.limiter.acquire()
+        try:
+            new = thread.update()
+        except requests.RequestException:
+            self.errors += 1
+            self.add(thread, time.time() + self.max_interval)
+            return thread, ThreadDelta()
+
+        if thread.alive:
+            self.add(thread, time.time() + self.interval(thread))
+        return thread, new
+
+    def run(self, callback=None):
+        """ Keep polling until every thread has 404'd or been removed.
+
+            :param callback: called as ``callback(thread, new)`` after every
+                             poll, where ``new`` is the number of new replies
+            :type callback: callable or None
+        """
+        while True:
+            polled = self.step()
+            if polled is None:
+                return
+            if callback is not None:
+                callback(*polled)
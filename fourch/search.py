@@ -0,0 +1,150 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import re
+
+from .reply import render_comment
+
+_word_re = re.compile(r"\w+", flags=re.U)
+_query_re = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """ Split text into lowercased words.
+
+        :param text: the text to split
+        :type text: str
+        :return: the words, in order
+        :rtype: list
+    """
+    return [w.lower() for w in _word_re.findall(text)]
+
+
+class SearchIndex(object):
+    """ An inverted index over the subjects and comment text of replies,
+        updated incrementally as threads pull in new replies, so searching
+        doesn't mean rescanning every post.
+
+        It's fed by :meth:`fourch.Thread.update`, and searched through
+        :meth:`fourch.Board.search`.
+    """
+
+    def __init__(self):
+        # {term: {(thread, post): [positions]}}
+        self._postings = {}
+        # {(thread, post): (fourch.Reply, [terms])}
+        self._docs = {}
+        # {thread: set(posts)}
+        self._threads = {}
+
+    def __repr__(self):
+        return "<{0} {1} posts, {2} terms>".format(
+            self.__class__.__name__,
+            len(self._docs),
+            len(self._postings)
+        )
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, res):
+        """ Is anything from the given thread indexed? """
+        return int(res) in self._threads
+
+    @staticmethod
+    def _key(reply):
+        return (int(reply._thread.res), reply.number)
+
+    def add(self, reply):
+        """ Index a reply, replacing it if it's already indexed.
+
+            :param reply: the reply to index
+            :type reply: :class:`fourch.Reply`
+        """
+        key = self._key(reply)
+        self._discard(key)
+
+        positions = {}
+        words = (tokenize(render_comment(reply.subject))
+                 + tokenize(reply.comment_text))
+        for i, term in enumerate(words):
+            positions.setdefault(term, []).append(i)
+        for term, pos in positions.items():
+            self._postings.setdefault(term, {})[key] = pos
+        self._docs[key] = (reply, list(positions))
+        self._threads.setdefault(key[0], set()).add(key[1])
+
+    def remove(self, reply):
+        """ Stop indexing a reply.
+
+            :param reply: the reply to drop
+            :type reply: :class:`fourch.Reply`
+        """
+        self._discard(self._key(reply))
+
+    def remove_thread(self, res):
+        """ Stop indexing every reply in a thread.
+
+            :param res: the thread's number
+            :type res: str or int
+        """
+        res = int(res)
+        for no in list(self._threads.get(res, ())):
+            self._discard((res, no))
+
+    def _discard(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        posts = self._threads[key[0]]
+        posts.discard(key[1])
+        if not posts:
+            del self._threads[key[0]]
+        for term in doc[1]:
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query):
+        """ Find the replies matching every term and "quoted phrase" in the
+            query. Matching is case insensitive, on whole words.
+
+            :param query: the search query, e.g. 'linux "year of the desktop"'
+            :type query: str
+            :return: the matching replies, by thread and then post number
+            :rtype: list of :class:`fourch.Reply`
+        """
+        terms = []
+        phrases = []
+        for phrase, term in _query_re.findall(query):
+            words = tokenize(phrase or term)
+            terms.extend(words)
+            if len(words) > 1:
+                phrases.append(words)
+        if not terms:
+            return []
+
+        postings = []
+        for term in set(terms):
+            p = self._postings.get(term)
+            if p is None:
+                return []
+            postings.append(p)
+
+        # Intersect starting from the rarest term.
+        postings.sort(key=len)
+        keys = set(postings[0])
+        for p in postings[1:]:
+            keys.intersection_update(p)
+
+        return [self._docs[key][0]
+                for key in sorted(keys)
+                if all(self._has_phrase(key, words) for words in phrases)]
+
+    def _has_phrase(self, key, words):
+        starts = set(self._postings[words[0]][key])
+        for offset, term in enumerate(words[1:], 1):
+            positions = self._postings[term][key]
+            starts.intersection_update(p - offset for p in positions)
+            if not starts:
+                return False
+        return True
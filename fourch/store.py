@@ -0,0 +1,129 @@
+# vim: sw=4 expandtab softtabstop=4 autoindent
+import json
+import sqlite3
+import threading
+
+
+class SQLiteStore(object):
+    """ A persistent store of threads backed by a local SQLite database, so
+        a :class:`fourch.Board` can pick up where it left off after a restart.
+
+        It keeps every post's json, and each thread's liveness and
+        Last-Modified header, so restored threads go straight back to
+        If-Modified-Since updates rather than being fetched in full.
+
+        Any other backend just needs the same :meth:`load_thread` and
+        :meth:`save_thread` methods.
+    """
+
+    def __init__(self, path):
+        """ Open (or create) the database.
+
+            :param path: the database file, or ``:memory:``
+            :type path: str
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS threads ("
+                             " board TEXT NOT NULL,"
+                             " res INTEGER NOT NULL,"
+                             " alive INTEGER NOT NULL,"
+                             " last_modified TEXT,"
+                             " PRIMARY KEY (board, res))")
+            self._db.execute("CREATE TABLE IF NOT EXISTS posts ("
+                             " board TEXT NOT NULL,"
+                             " res INTEGER NOT NULL,"
+                             " no INTEGER NOT NULL,"
+                             " json TEXT NOT NULL,"
+                             " PRIMARY KEY (board, no))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS posts_thread"
+                             " ON posts (board, res, no)")
+
+    def __repr__(self):
+        return "<{0} {1}>".format(self.__class__.__name__, self.path)
+
+    def load_thread(self, board, res):
+        """ Load a thread out of the store.
+
+            :param board: the board's name
+            :type board: str
+            :param res: the thread number
+            :type res: str or int
+            :return: None if the thread isn't stored, otherwise a dict of
+                     ``alive``, ``last_modified`` and ``posts``, the json of
+                     the op and every reply in order
+            :rtype: dict or None
+        """
+        with self._lock:
+            row = self._db.execute("SELECT alive, last_modified FROM threads"
+                                   " WHERE board = ? AND res = ?",
+                                   (board, int(res))).fetchone()
+            if row is None:
+                return None
+            posts = self._db.execute("SELECT json FROM posts"
+                                     " WHERE board = ? AND res = ?"
+                                     " ORDER BY no",
+                                     (board, int(res))).fetchall()
+        if not posts:
+            return None
+        return {
+            "alive": bool(row[0]),
+            "last_modified": row[1],
+            "posts": [json.loads(p[0]) for p in posts],
+        }
+
+    def save_thread(self, board, res, alive, last_modified,
+                    posts=(), deleted=()):
+        """ Save a thread's state, along with any new or changed posts, in a
+            single transaction.
+
+            :param board: the board's name
+            :type board: str
+            :param res: the thread number
+            :type res: str or int
+            :param alive: whether or not the thread is alive
+            :type alive: bool
+            :param last_modified: the thread's Last-Modified header
+            :type last_modified: str or None
+            :param posts: the json of posts to write
+            :type posts: list
+            :param deleted: the numbers of posts to remove
+            :type deleted: list
+        """
+        res = int(res)
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO threads"
+                                 " (board, res, alive, last_modified)"
+                                 " VALUES (?, ?, ?, ?)",
+                                 (board, res, int(alive), last_modified))
+                self._db.executemany("INSERT OR REPLACE INTO posts"
+                                     " (board, res, no, json)"
+                                     " VALUES (?, ?, ?, ?)",
+                                     [(board, res, p["no"], json.dumps(p))
+                                      for p in posts])
+                self._db.executemany("DELETE FROM posts"
+                                     " WHERE board = ? AND no = ?",
+                                     [(board, no) for no in deleted])
+
+    def threads(self, board, alive=True):
+        """ List the stored threads of a board.
+
+            :param board: the board's name
+            :type board: str
+            :param alive: only list threads which haven't 404'd
+            :type alive: bool
+            :return: the thread numbers
+            :rtype: list
+        """
+        query = "SELECT res FROM threads WHERE board = ?"
+        if alive:
+            query += " AND alive = 1"
+        with self._lock:
+            return [row[0] for row in self._db.execute(query, (board,))]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,6 +1,55 @@
 # vim: sw=4 expandtab softtabstop=4 autoindent
+import bisect
+import email.utils
+
 import requests
-from .reply import Reply
+from .client import decode
+from .reply import Reply, render_comment
+
+
+class ThreadDelta(int):
+    """ What changed in a thread on an update.
+
+        It's the number of new replies, as update used to return, so it can
+        still be used as one; the details are in its attributes:
+
+        - added: the new replies
+        - deleted: the replies which are gone
+        - changed: the posts whose json changed, including the op
+        - file_deleted: the posts whose file was deleted
+        - sticky: whether the thread is now stuck, if that changed, or None
+        - closed: whether the thread is now closed, if that changed, or None
+        - died: whether the thread 404'd
+    """
+
+    def __new__(cls, added=(), deleted=(), changed=(), file_deleted=(),
+                sticky=None, closed=None, died=False):
+        delta = int.__new__(cls, len(added))
+        delta.added = list(added)
+        delta.deleted = list(deleted)
+        delta.changed = list(changed)
+        delta.file_deleted = list(file_deleted)
+        delta.sticky = sticky
+        delta.closed = closed
+        delta.died = died
+        return delta
+
+    def __repr__(self):
+        return ("<{0} +{1} -{2} ~{3}, {4} files deleted{5}{6}{7}>".format(
+            self.__class__.__name__,
+            len(self.added),
+            len(self.deleted),
+            len(self.changed),
+            len(self.file_deleted),
+            "" if self.sticky is None else ", sticky: {0}".format(self.sticky),
+            "" if self.closed is None else ", closed: {0}".format(self.closed),
+            ", died" if self.died else ""
+        ))
+
+    @property
+    def empty(self):
+        """ Did nothing at all change? """
+        return not (self.added or self.deleted or self.changed or self.died)
 
 
 class Thread(object):
@@ -23,12 +72,16 @@ class Thread(object):
         self.alive = True
         self.op = None
         self.replies = []
+        self._posts = {}  # {no: fourch.Reply} -- the op and every reply
+        self._backlinks = {}  # {no: [numbers of the posts quoting it]}
         self.omitted_posts = 0
         self.omitted_images = 0
         # If this is a precached thread, should it get updated?
         self._should_update = False
         # HTTP Last-Modified header for If-Modified-Since
         self._last_modified = None
+        # Has every post been written to the board's store yet?
+        self._stored = False
 
     def __repr__(self):
         end = ""
@@ -44,8 +97,8 @@ class Thread(object):
             end
         )
 
-    @staticmethod
-    def from_req(board, res, r):
+    @classmethod
+    def from_req(cls, board, res, r):
         """ Create a thread object from the given request.
             If the thread has 404d, this will return None,
             and if it isn't 200 OK, it will raise_for_status().
@@ -61,15 +114,15 @@ class Thread(object):
         if r.status_code == requests.codes.not_found:
             return None
         elif r.status_code == requests.codes.ok:
-            return Thread.from_json(board,
-                                    r.json(),
-                                    res=res,
-                                    last_modified=r.headers["last-modified"])
+            return cls.from_json(board,
+                                 decode(board.session, r),
+                                 res=res,
+                                 last_modified=r.headers["last-modified"])
         else:
             r.raise_for_status()
 
-    @staticmethod
-    def from_json(board, json, res=None, last_modified=None):
+    @classmethod
+    def from_json(cls, board, json, res=None, last_modified=None):
         """ Create a thread object from the given JSON data.
 
             :param board: the :class:`fourch.Board` parent instance
@@ -83,13 +136,16 @@ class Thread(object):
             :return: the created :class:`fourch.Thread`
             :rtype: :class:`fourch.Thread`
         """
-        t = Thread(board, res)
+        t = cls(board, res)
         t._last_modified = last_modified
 
         replies = json["posts"]
 
-        t.op = Reply(t, replies.pop(0))
-        t.replies = [Reply(t, r) for r in replies]
+        t.op = Reply(t, replies[0])
+        t.replies = [Reply(t, r) for r in replies[1:]]
+        t._posts = dict((r.number, r) for r in t.replies)
+        t._posts[t.op.number] = t.op
+        t._link([t.op] + t.replies)
 
         if res is None:
             t._should_update = True
@@ -99,6 +155,17 @@ class Thread(object):
 
         return t
 
+    def get(self, no, default=None):
+        """ Look up a post in the thread by its number.
+
+            :param no: the post number
+            :type no: int
+            :param default: what to return if there's no such post
+            :return: the op or reply with that number
+            :rtype: :class:`fourch.Reply`
+        """
+        return self._posts.get(no, default)
+
     @property
     def sticky(self):
         """ Is this thread stuck?
@@ -117,6 +184,21 @@ class Thread(object):
         """
         return self.op.closed
 
+    @property
+    def last_modified(self):
+        """ When the thread was last modified, going by the Last-Modified
+            header of the response it was last fetched from.
+
+            :return: the UNIX timestamp, or None if it's unknown
+            :rtype: int or None
+        """
+        if not self._last_modified:
+            return None
+        parsed = email.utils.parsedate_tz(self._last_modified)
+        if parsed is None:
+            return None
+        return email.utils.mktime_tz(parsed)
+
     @property
     def last_reply(self):
         """ Return the last :class:`fourch.Reply` to the thread, or the op
@@ -129,6 +211,21 @@ class Thread(object):
             return self.op
         return self.replies[-1]
 
+    def comment_texts(self):
+        """ Get the plain text comments of the op and every reply, in order.
+            See :attr:`fourch.Reply.comment_text`.
+
+            :return: a list of the plain text comments
+            :rtype: list
+        """
+        op = self.op.number
+        texts = []
+        for r in [self.op] + self.replies:
+            if r._text is None:
+                r._text = render_comment(r.comment, op)
+            texts.append(r._text)
+        return texts
+
     @property
     def images(self):
         """ Create a generator which yields all of the image urls for the thread.
@@ -148,62 +245,285 @@ class Thread(object):
 
             :param force: should replies be replaced with fresh reply objects
             :type force: bool
-            :return: the number of new replies
-            :rtype: int
+            :return: what changed, which is also the number of new replies
+            :rtype: :class:`fourch.ThreadDelta`
         """
         if not self.alive and not force:
-            return 0
+            return ThreadDelta()
+        return self._updated(self._fetch(), force=force)
 
+    def _fetch(self):
+        """ Send the request for :meth:`update`, and decode the response,
+            without touching the thread itself. This part is safe to run on
+            several threads at once; :meth:`_updated` isn't.
+
+            :return: the status code, and the posts and Last-Modified header
+                     if it's 200 OK
+            :rtype: tuple
+        """
         url = self._board.url("api_thread",
                               board=self._board.name,
                               thread=self.res)
-        headers = None
-        if self._last_modified:
-            # If-Modified-Since, to not waste bandwidth.
-            headers = {
-                "If-Modified-Since": self._last_modified
-            }
+        r = self._board.session.get(url, headers=self._headers())
+
+        if r.status_code == requests.codes.ok:
+            return (r.status_code,
+                    decode(self._board.session, r)["posts"],
+                    r.headers["last-modified"])
+        if r.status_code not in (requests.codes.not_modified,
+                                 requests.codes.not_found):
+            r.raise_for_status()
+        return r.status_code, None, None
 
-        r = self._board._session.get(url, headers=headers)
+    def _updated(self, fetched, force=False):
+        """ Apply the result of :meth:`_fetch` to the thread.
 
-        if r.status_code == requests.codes.not_modified:
-            # 304 Not Modified
-            return 0
+            :param fetched: what :meth:`_fetch` returned
+            :type fetched: tuple
+            :param force: should replies be replaced with fresh reply objects
+            :type force: bool
+            :return: what changed
+            :rtype: :class:`fourch.ThreadDelta`
+        """
+        status, posts, last_modified = fetched
 
-        elif r.status_code == requests.codes.not_found:
+        if status == requests.codes.not_found:
             # 404 Not Found
-            self.alive = False
-            # Remove from cache.
-            self._board._cache.pop(self.res, None)
-            return 0
+            self._died()
+            return ThreadDelta(died=True)
 
-        elif r.status_code == requests.codes.ok:
-            if not self.alive:
-                self.alive = True
-                self._board._cache[self.res] = self
-
-            self._should_update = False
-            self.omitted_posts = 0
-            self.omitted_images = 0
-
-            self._last_modified = r.headers["last-modified"]
-            replies = r.json()["posts"]
-
-            post_count = len(self.replies)
-            self.op = Reply(self, replies.pop(0))
-            if not force:
-                self.replies.extend(
-                    [Reply(self, p)
-                     for p in replies
-                     if p["no"] > self.last_reply.number]
-                )
-            else:
-                self.replies = [Reply(self, p) for p in replies]
-            post_count_new = len(self.replies)
-            post_count_diff = post_count_new - post_count
-            if post_count_diff < 0:
-                raise Exception("post count delta is somehow negative...")
-            return post_count_diff
+        elif status == requests.codes.ok:
+            return self._apply(posts, last_modified, force=force)
+
+        # 304 Not Modified
+        return ThreadDelta()
+
+    def _headers(self):
+        """ The headers to send when updating the thread.
+        """
+        # Threads made from a page are missing their omitted posts, and
+        # carry the page's Last-Modified, so they always need a full fetch.
+        partial = self.omitted_posts or self.omitted_images
+        if not self._last_modified or partial:
+            return None
+        # If-Modified-Since, to not waste bandwidth.
+        return {
+            "If-Modified-Since": self._last_modified
+        }
+
+    def _died(self):
+        """ Mark the thread as 404'd, and drop it from the board's cache.
+        """
+        self.alive = False
+        self._board._cache.pop(self.res, None)
+        self._unindex()
+        self._save()
+
+    def _apply(self, replies, last_modified, force=False):
+        """ Merge a freshly fetched list of posts into the thread.
+
+            :param replies: the thread's posts, as in the ``posts`` list of
+                            the thread json
+            :type replies: list
+            :param last_modified: the response's Last-Modified header
+            :type last_modified: str
+            :param force: should replies be replaced with fresh reply objects
+            :type force: bool
+            :return: what changed
+            :rtype: :class:`fourch.ThreadDelta`
+        """
+        self.alive = True
+
+        self._should_update = False
+        self.omitted_posts = 0
+        self.omitted_images = 0
 
+        self._last_modified = last_modified
+
+        op = replies[0]
+        changed = []
+        file_deleted = []
+        sticky = closed = None
+        if self.op is not None and self.op.number == op["no"]:
+            if self.op.sticky != bool(op.get("sticky", 0)):
+                sticky = not self.op.sticky
+            if self.op.closed != bool(op.get("closed", 0)):
+                closed = not self.op.closed
+            if _file_deleted(self.op._json, op):
+                file_deleted.append(self.op)
+        if force or self.op is None or self.op.number != op["no"]:
+            if self.op is not None and not force:
+                self._unlink(self.op)
+            self.op = Reply(self, op)
+            changed.append(self.op)
+        elif self.op._json != op:
+            # Its quotes are about to be forgotten, so unlink them first.
+            self._unlink(self.op)
+            self.op._load(op)
+            changed.append(self.op)
+
+        if force:
+            old = self._posts
+            self._backlinks = {}
+            self.replies = [Reply(self, p) for p in replies[1:]]
+            self._posts = dict((r.number, r) for r in self.replies)
+            new = [r for r in self.replies if r.number not in old]
+            changed.extend(r for r in self.replies if r.number in old)
+            file_deleted.extend(
+                r for r in self.replies
+                if r.number in old and _file_deleted(old[r.number]._json,
+                                                     r._json))
+            deleted = [r for no, r in old.items()
+                       if no not in self._posts and no != self.op.number]
         else:
-            r.raise_for_status()
+            new, reloaded, deleted, files = self._merge(replies[1:])
+            changed.extend(reloaded)
+            file_deleted.extend(files)
+            for r in deleted:
+                self._posts.pop(r.number, None)
+        self._posts[self.op.number] = self.op
+
+        if force:
+            self._link([self.op] + self.replies)
+        else:
+            self._link(new + changed, deleted)
+        self._save(new + changed, deleted)
+        self._index(new + changed, deleted)
+
+        # (Re)store it, so a bounded cache sees its new size and freshness.
+        self._board._cache[self.res] = self
+        return ThreadDelta(added=new,
+                           deleted=deleted,
+                           changed=changed,
+                           file_deleted=file_deleted,
+                           sticky=sticky,
+                           closed=closed)
+
+    def _link(self, posts, deleted=()):
+        """ Add the quotelinks of the given posts to the thread's reply
+            graph, and take out those of deleted posts.
+
+            :param posts: the new or changed replies
+            :type posts: list
+            :param deleted: the replies which are gone
+            :type deleted: list
+        """
+        for r in posts:
+            for no in r.quotes:
+                quoted_by = self._backlinks.setdefault(no, [])
+                i = bisect.bisect_left(quoted_by, r.number)
+                if i == len(quoted_by) or quoted_by[i] != r.number:
+                    quoted_by.insert(i, r.number)
+        for r in deleted:
+            self._unlink(r)
+
+    def _unlink(self, r):
+        """ Take a post's quotelinks out of the thread's reply graph, before
+            it's deleted or its json (and so its quotes) is replaced.
+        """
+        for no in r.quotes:
+            quoted_by = self._backlinks.get(no)
+            if quoted_by and r.number in quoted_by:
+                quoted_by.remove(r.number)
+
+    def _index(self, posts=None, deleted=()):
+        """ Feed the given new or changed posts to the board's search index,
+            if it has one.
+
+            :param posts: the replies to index, or None for every post
+            :type posts: list or None
+            :param deleted: the replies to drop from the index
+            :type deleted: list
+        """
+        index = self._board._index
+        if index is None:
+            return
+        if posts is None or self.res not in index:
+            # Threads which were dropped from the index (say, evicted from
+            # the cache and then updated anyway) go back in whole.
+            posts = [self.op] + self.replies
+        for r in posts:
+            index.add(r)
+        for r in deleted:
+            index.remove(r)
+
+    def _unindex(self):
+        """ Drop all of the thread's posts from the board's search index.
+        """
+        if self._board._index is not None:
+            self._board._index.remove_thread(self.res)
+
+    def _save(self, posts=(), deleted=()):
+        """ Write the thread's state, along with the given new or changed
+            posts, to the board's store, if it has one. The first time a
+            thread is saved, every post is written.
+
+            :param posts: the replies to write
+            :type posts: list
+            :param deleted: the replies to remove
+            :type deleted: list
+        """
+        store = self._board._store
+        if store is None:
+            return
+        if not self._stored and self.op is not None:
+            posts = [self.op] + self.replies
+        store.save_thread(self._board.name,
+                          self.res,
+                          self.alive,
+                          self._last_modified,
+                          posts=[r._json for r in posts],
+                          deleted=[r.number for r in deleted])
+        self._stored = True
+
+    def _merge(self, posts):
+        """ Merge the given posts into :attr:`replies`, in one pass over
+            both. Replies we already hold are kept (and reloaded if their
+            json changed), rather than being made again.
+
+            :param posts: every reply's json, sorted by post number
+            :type posts: list
+            :return: the new replies, the replies which were reloaded, the
+                     replies which are gone upstream, and the replies whose
+                     file was deleted
+            :rtype: tuple
+        """
+        old = self.replies
+        merged = []
+        new = []
+        reloaded = []
+        deleted = []
+        file_deleted = []
+        i = 0
+
+        for p in posts:
+            no = p["no"]
+            while i < len(old) and old[i].number < no:
+                deleted.append(old[i])
+                i += 1
+
+            if i < len(old) and old[i].number == no:
+                r = old[i]
+                i += 1
+                if r._json != p:
+                    if _file_deleted(r._json, p):
+                        file_deleted.append(r)
+                    self._unlink(r)
+                    r._load(p)
+                    reloaded.append(r)
+            else:
+                r = Reply(self, p)
+                self._posts[no] = r
+                new.append(r)
+            merged.append(r)
+
+        deleted.extend(old[i:])
+        self.replies = merged
+        return new, reloaded, deleted, file_deleted
+
+
+def _file_deleted(old, new):
+    """ Was the post's file deleted between these two versions of its json?
+    """
+    return ("filename" in old and not old.get("filedeleted")
+            and bool(new.get("filedeleted")))
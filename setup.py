@@ -13,6 +13,7 @@ Requirements
 
 - Python 2.7 (what I test with, 2.x might work)
 - requests
+- aiohttp, for the optional asyncio client in ``fourch.aio`` (Python 3.6+)
 
 Notes
 -----
@@ -47,6 +48,9 @@ kw = {
     "license": "MIT",
     "packages": ["fourch"],
     "install_requires": ["requests"],
+    "extras_require": {
+        "async": ["aiohttp"]
+    },
     "zip_safe": False,
     "keywords": "wrapper 4chan chan json",
     "classifiers": [